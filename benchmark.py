@@ -0,0 +1,138 @@
+#!python
+# Measures the search stages of the log_analyzer package on synthetic CDTs (see gen_cdt.py) of different sizes
+# Usage: python benchmark.py --sizes 100M,1G,10G --output bench.json [--compare old_bench.json]
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+
+import gen_cdt
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+def peakRSS():
+    '''Peak resident memory of this process in MB, None where it can't be read'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def runStages(workingDir, CDTname, msgID, jobs):
+    '''Runs the search stages of the log_analyzer package one after the other on the CDT, in this process, and
+    returns {stage: {"seconds", "items", "peak_rss_mb"}}. Indexes are built from scratch, so the first search of each
+    log family includes building its index and the second one shows a search with the index already saved.'''
+    from log_analyzer import Searcher, getIMSSLogsBatch, getMaillogs, combineMaillogMessages
+    searcher = Searcher(workingDir, CDTname, jobs)
+
+    for name in os.listdir(searcher.outputDir) if os.path.isdir(searcher.outputDir) else []:
+        if name.startswith("___") and name.endswith(".json"):
+            os.remove(searcher.outputDir + name)
+
+    stages = {}
+
+    def stage(name, function, items=None):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        stages[name] = {"seconds": round(seconds, 3),
+                        "items": items(result) if items else None,
+                        "peak_rss_mb": peakRSS()}
+        return result
+
+    stage("findMessagesinIMSSlogs", lambda: searcher.findMessagesinIMSSlogs(msgID), len)
+    # Searching again only reads the saved index
+    messages = stage("findMessagesinIMSSlogs (indexed)", lambda: searcher.findMessagesinIMSSlogs(msgID), len)
+    stage("getIMSSLogs", lambda: getIMSSLogsBatch(messages, searcher.logSet()),
+          lambda result: sum(len(m.IMSSLogs) for m in messages))
+    maillog_messages = stage("findMessagesinMaillogs", lambda: searcher.findMessagesinMaillogs(msgID), len)
+    index = stage("getMaillogIndex", searcher.getMaillogIndex)
+
+    def getAllMaillogs():
+        for m in maillog_messages:
+            m.maillogs = getMaillogs(m, index, searcher.maillogFolder)
+    stage("getMaillogs", getAllMaillogs, lambda result: sum(len(m.maillogs) for m in maillog_messages))
+    stage("combineMaillogMessages", lambda: combineMaillogMessages(maillog_messages) or [], len)
+    return stages
+
+def benchmarkSize(size, workingDir, msgID, jobs, rotateSize):
+    '''Generates (or reuses) a CDT of size ("100M") and measures it in a new process, so the peak RSS is its own'''
+    CDTname = f"bench_CDT-{size}.zip"
+    manifest = gen_cdt.generateCDT(os.path.join(workingDir, CDTname[:-4]), gen_cdt.parseSize(size), rotateSize)
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", workingDir, CDTname,
+                              "--message-id", msgID, "--jobs", str(jobs)],
+                             stdout=subprocess.PIPE, check=True)
+    stages = json.loads(process.stdout.decode().splitlines()[-1])
+
+    # Throughput of each stage over the log family it works on
+    families = {"IMSS": ("imss_bytes", "imss_lines"), "Maillog": ("maillog_bytes", "maillog_lines")}
+    for name, result in stages.items():
+        bytes_key, lines_key = families["IMSS" if "IMSS" in name else "Maillog"]
+        seconds = max(result["seconds"], 1e-6)
+        result["lines_per_s"] = round(manifest[lines_key] / seconds)
+        result["mb_per_s"] = round(manifest[bytes_key] / (1024 * 1024) / seconds, 1)
+    return {"size": size, "manifest": manifest, "stages": stages}
+
+def compareResults(old, new):
+    '''Prints the speedup of each stage in new over old (from two --output files) for the sizes in both'''
+    old_runs = {run["size"]: run for run in old["runs"]}
+    for run in new["runs"]:
+        if run["size"] not in old_runs:
+            continue
+        print(f"{run['size']}:")
+        for name, result in run["stages"].items():
+            before = old_runs[run["size"]]["stages"].get(name)
+            if before:
+                print(f"  {name:36} {before['seconds']:10.3f}s -> {result['seconds']:10.3f}s "
+                      f"({before['seconds'] / max(result['seconds'], 1e-6):.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the log search on synthetic CDTs")
+    parser.add_argument("-s", "--sizes", default="100M,1G,10G",
+                        help="Comma separated sizes of the CDTs to measure, default='100M,1G,10G'")
+    parser.add_argument("-d", "--dir", default=os.path.join(tempfile.gettempdir(), "log-analyzer-bench"),
+                        help="Folder for the generated CDTs, which are kept and reused by later runs")
+    parser.add_argument("-r", "--rotate", default="50M", help="Size at which log files are rotated, default='50M'")
+    parser.add_argument("-m", "--message-id", default="@astound.net",
+                        help="Message ID searched for, default='@astound.net' (about a fifth of the messages)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="--jobs of the searches")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--run", nargs=2, metavar=("DIR", "CDT"), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.run:
+        # Child process of benchmarkSize()
+        print(json.dumps(runStages(os.path.join(options.run[0], ""), options.run[1], options.message_id,
+                                   options.jobs)))
+        sys.exit(0)
+
+    options.dir = os.path.abspath(options.dir)
+    os.makedirs(options.dir, exist_ok=True)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "jobs": options.jobs,
+        "message_id": options.message_id,
+        "runs": [],
+    }
+    for size in options.sizes.split(","):
+        results["runs"].append(benchmarkSize(size.strip(), options.dir, options.message_id,
+                                             options.jobs, gen_cdt.parseSize(options.rotate)))
+        print(json.dumps(results["runs"][-1], indent=2))
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if options.compare:
+        with open(options.compare, "r") as f:
+            compareResults(json.load(f), results)
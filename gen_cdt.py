@@ -0,0 +1,242 @@
+#!python
+# Writes a synthetic unzipped CDT with log.imss and maillog files of a given size, for testing and benchmarks
+# Usage: python gen_cdt.py C:/Users/joelg/Documents/Lab/ --size 1G
+
+import os
+import sys
+import json
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# Same log folders as the ones the log search reads
+from log_analyzer.settings import IMSSLogDir, maillogDir
+
+# Written next to the IMSVA folder, so a CDT that was already generated with the same settings is not written again
+ManifestFile = "___generated___.json"
+
+domains = ["astound.net", "example.com", "sat.gob.mx", "sendgrid.net", "CRRJ01VS002.cra1.local"]
+units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parseSize(text):
+    '''"100M" -> 104857600'''
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+class RotatingLog(object):
+    '''A log file that is closed and replaced by a new one from nextName() once it is over rotateSize bytes.
+    Each closed file gets the time of its last line as mtime, like a real log.'''
+
+    def __init__(self, folder, nextName, rotateSize):
+        self.folder = folder
+        self.nextName = nextName
+        self.rotateSize = rotateSize
+        self.files = []
+        self.bytes = 0
+        self.lines = 0
+        self.file = None
+        self.lastTime = None
+
+    def write(self, time, line):
+        if self.file is None:
+            self.files.append(os.path.join(self.folder, self.nextName(time)))
+            self.file = open(self.files[-1], "w", encoding="latin-1", newline="\n")
+        self.file.write(line)
+        self.bytes += len(line)
+        self.lines += 1
+        self.lastTime = time
+        if self.file.tell() > self.rotateSize:
+            self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            mtime = self.lastTime.timestamp()
+            os.utime(self.files[-1], (mtime, mtime))
+            self.file = None
+
+class CDTGenerator(object):
+    '''Writes interleaved log.imss and maillog lines for a stream of messages. Each message gets a Postfix queue
+    ID that hands off to IMSS on port 10025, an IMSS scan (rule set retrieval, Message-ID, scan lines and "Scan
+    finished for" on one process ID), then a second queue ID after the scan and sometimes a third hop on port
+    10026, and for some messages policy event lines in the polevt log. Up to `slots` messages are scanned at once, so
+    scans of different messages interleave and run over log.imss rotations, day changes and the New Year the same way
+    they do on a busy appliance.'''
+
+    def __init__(self, folder, seed=1, rotateSize=50 * units["M"], start=datetime(2021, 11, 5, 23, 50),
+                 host="IMSVA9-1chile", slots=12):
+        self.rng = random.Random(seed)
+        self.clock = start
+        self.host = host
+        self.slots = [None] * slots
+        self.queueIDs = set()
+        self.messages = 0
+        self.day = {}  # file name prefix: day of the last file
+        self.sequence = {}  # file name prefix: NNNN of the last file
+        os.makedirs(os.path.join(folder, IMSSLogDir), exist_ok=True)
+        os.makedirs(os.path.join(folder, maillogDir), exist_ok=True)
+        self.imss = RotatingLog(os.path.join(folder, IMSSLogDir), self.IMSSFileName, rotateSize)
+        self.maillog = RotatingLog(os.path.join(folder, maillogDir), self.maillogFileName, rotateSize)
+        self.polevt = RotatingLog(os.path.join(folder, IMSSLogDir), self.polevtFileName, rotateSize)
+
+    def dailyFileName(self, prefix, time):
+        # prefix.YYYYMMDD.NNNN, NNNN starting again from 0001 every day
+        if time.date() != self.day.get(prefix):
+            self.day[prefix] = time.date()
+            self.sequence[prefix] = 0
+        self.sequence[prefix] += 1
+        return f"{prefix}.{time:%Y%m%d}.{self.sequence[prefix]:04d}"
+
+    def IMSSFileName(self, time):
+        return self.dailyFileName("log.imss", time)
+
+    def polevtFileName(self, time):
+        return self.dailyFileName("polevt.imss", time)
+
+    def maillogFileName(self, time):
+        # Renamed to maillog, maillog.1, maillog.2... (newest first) once all are written
+        return f"maillog.part{len(self.maillog.files)}"
+
+    def newQueueID(self):
+        while True:
+            queue_ID = "%010X" % self.rng.getrandbits(40)
+            if queue_ID not in self.queueIDs:
+                self.queueIDs.add(queue_ID)
+                return queue_ID
+
+    def IMSSLog(self, procID, text):
+        self.imss.write(self.clock, f"{self.clock:%Y/%m/%d %H:%M:%S} GMT-03:00 {procID} [I]{text}\n")
+
+    def maillogLog(self, service, queue_ID, text):
+        self.maillog.write(self.clock, f"{self.clock:%b} {self.clock.day:2d} {self.clock:%H:%M:%S} {self.host} "
+                                       f"postfix/{service}[{self.rng.randint(1000, 30000)}]: {queue_ID}: {text}\n")
+
+    def startMessage(self, k):
+        rng = self.rng
+        self.messages += 1
+        externalID = f"{rng.getrandbits(64):016x}.{self.messages}@{rng.choice(domains)}"
+        queue_ID, next_queue_ID = self.newQueueID(), self.newQueueID()
+        self.maillogLog("cleanup", queue_ID, f"message-id=<{externalID}>")
+        self.maillogLog("qmgr", queue_ID, f"from=<a{self.messages}@sender.com>, size={rng.randint(1000, 90000)}, "
+                                          "nrcpt=1 (queue active)")
+        self.maillogLog("smtp", queue_ID, "to=<joelg@joelg.com>, relay=localhost[127.0.0.1]:10025, delay=0.5, "
+                                          "delays=0.1/0/0.1/0.3, dsn=2.0.0, status=sent "
+                                          f"(250 2.0.0 Ok: queued as {next_queue_ID})")
+        self.maillogLog("qmgr", queue_ID, "removed")
+        procID = f"[{20000 + k}:{rng.getrandbits(32)}]"
+        self.slots[k] = {"procID": procID, "externalID": externalID, "queueID": next_queue_ID, "step": 0,
+                         "steps": rng.randint(3, 30)}
+        self.IMSSLog(procID, "Start Rule Set Retrieval spent 0 ms")
+
+    def continueMessage(self, k):
+        rng = self.rng
+        scan = self.slots[k]
+        scan["step"] += 1
+        if scan["step"] == 2:
+            self.IMSSLog(scan["procID"], f">>> Message-ID : <{scan['externalID']}>")
+        elif scan["step"] < scan["steps"]:
+            self.IMSSLog(scan["procID"], f"Scan engine processing attachment {scan['step']} result=clean")
+        else:
+            internalID = "%08X-%04X-%04X-%04X-%012X" % (rng.getrandbits(32), rng.getrandbits(16),
+                                                        rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(48))
+            if rng.random() < 0.3:
+                self.polevt.write(self.clock, f"{self.clock:%Y/%m/%d %H:%M:%S} GMT-03:00 Policy event: "
+                                              f"rule=Default Policy, filter=Attachment, action=deliver, "
+                                              f"message={internalID}, sender=a{self.messages}@sender.com\n")
+            self.IMSSLog(scan["procID"], f"Scan finished for {internalID}, action=deliver")
+            queue_ID = scan["queueID"]
+            self.maillogLog("cleanup", queue_ID, f"message-id=<{scan['externalID']}>")
+            self.maillogLog("qmgr", queue_ID, "from=<a@sender.com>, size=1234, nrcpt=1 (queue active)")
+            if rng.random() < 0.2:
+                next_queue_ID = self.newQueueID()
+                self.maillogLog("smtp", queue_ID, "to=<joelg@joelg.com>, relay=localhost[127.0.0.1]:10026, "
+                                                  "delay=0.5, delays=0.1/0/0.1/0.3, dsn=2.0.0, status=sent "
+                                                  f"(250 2.0.0 Ok: queued as {next_queue_ID})")
+                self.maillogLog("qmgr", queue_ID, "removed")
+                self.maillogLog("cleanup", next_queue_ID, f"message-id=<{scan['externalID']}>")
+                queue_ID = next_queue_ID
+            self.maillogLog("smtp", queue_ID, "to=<joelg@joelg.com>, relay=mx.joelg.com[1.2.3.4]:25, delay=1, "
+                                              "delays=0.1/0/0.4/0.5, dsn=2.0.0, status=sent (250 ok)")
+            self.maillogLog("qmgr", queue_ID, "removed")
+            self.slots[k] = None
+
+    def generate(self, size):
+        '''Writes messages until the log files add up to size bytes'''
+        while self.imss.bytes + self.maillog.bytes < size:
+            self.clock += timedelta(milliseconds=self.rng.randint(0, 400))
+            k = self.rng.randrange(len(self.slots))
+            if self.slots[k] is None:
+                self.startMessage(k)
+            else:
+                self.continueMessage(k)
+        self.imss.close()
+        self.maillog.close()
+        self.polevt.close()
+
+        # Newest maillog is "maillog", older ones "maillog.1", "maillog.2"...
+        maillogs = []
+        for i, part in enumerate(reversed(self.maillog.files)):
+            name = os.path.join(os.path.dirname(part), "maillog" + (f".{i}" if i else ""))
+            os.replace(part, name)
+            maillogs.append(name)
+        self.maillog.files = maillogs
+
+    def manifest(self):
+        return {
+            "messages": self.messages,
+            "imss_files": len(self.imss.files),
+            "imss_bytes": self.imss.bytes,
+            "imss_lines": self.imss.lines,
+            "maillog_files": len(self.maillog.files),
+            "maillog_bytes": self.maillog.bytes,
+            "maillog_lines": self.maillog.lines,
+            "polevt_files": len(self.polevt.files),
+            "polevt_lines": self.polevt.lines,
+        }
+
+def generateCDT(folder, size, rotateSize=50 * units["M"], seed=1):
+    '''Writes a CDT of about size bytes of logs into folder (the unzipped CDT folder, which main.py uses when there
+    is no CDT zip), unless one was already generated there with the same settings. Returns its manifest.'''
+    settings = {"size": size, "rotate_size": rotateSize, "seed": seed, "polevt": True}
+    try:
+        with open(os.path.join(folder, ManifestFile), "r") as f:
+            manifest = json.load(f)
+        if manifest["settings"] == settings:
+            logging.info(f"Using CDT already generated in {folder}")
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    for logDir, prefix in ((IMSSLogDir, "log.imss"), (IMSSLogDir, "polevt"), (maillogDir, "maillog")):
+        if os.path.isdir(os.path.join(folder, logDir)):
+            for file in os.listdir(os.path.join(folder, logDir)):
+                if file.startswith(prefix):
+                    os.remove(os.path.join(folder, logDir, file))
+    logging.info(f"Generating {size} bytes of logs in {folder}...")
+    generator = CDTGenerator(folder, seed, rotateSize)
+    generator.generate(size)
+    manifest = generator.manifest()
+    manifest["settings"] = settings
+    with open(os.path.join(folder, ManifestFile), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic unzipped CDT for testing and benchmarks")
+    parser.add_argument("dir", help="Folder to write the CDT folder in, like --dir of main.py")
+    parser.add_argument("-c", "--cdt", default="synthetic_CDT-20211107-004446.zip",
+                        help="CDT name, the logs are written to the folder of the same name without .zip")
+    parser.add_argument("-s", "--size", default="100M", help="Total size of the log files, default='100M'")
+    parser.add_argument("-r", "--rotate", default="50M", help="Size at which log files are rotated, default='50M'")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed, the same seed writes the same logs")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    manifest = generateCDT(os.path.join(options.dir, options.cdt[:-4]), parseSize(options.size),
+                           parseSize(options.rotate), options.seed)
+    json.dump(manifest, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,53 @@
+'''Log search of IMSVA CDTs (Case Diagnostic Tool zips) as a library, the engine behind main.py.
+
+    from log_analyzer import Searcher
+
+    searcher = Searcher("C:/Users/joelg/Documents/Lab/", "lab_CDT-20211107-004446.zip", jobs=4)
+    searcher.unzip_CDT()
+    messages, maillog_messages, merged = searcher.search("@astound.net")
+    counts = searcher.window("2021-11-05 13:00:00", "2021-11-05 14:00:00").cachedSearch("@astound.net")
+
+Searchers take every path as an argument and never change the working directory, so several searches (of the same
+CDT or different ones) can run at once on threads of one process.
+Importing the package does nothing but define the names below: each module is only imported the first time one of
+its names is used, so a CLI that only parses its arguments starts in tens of milliseconds.'''
+
+import importlib
+
+# Public name: module of the package it comes from
+exports = {
+    "Searcher": "searcher",
+    "extractCDT": "searcher",
+    "CDTmemberPath": "searcher",
+    "Message": "messages",
+    "MultiMatcher": "messages",
+    "IMSSLogSet": "messages",
+    "combineMaillogMessages": "messages",
+    "getIMSSLogsBatch": "messages",
+    "getMaillogs": "messages",
+    "LogSpans": "logfiles",
+    "windowTime": "logfiles",
+    "ResultWriter": "results",
+    "ResultCache": "results",
+    "messageTimeline": "results",
+    "Profiler": "profiling",
+    "profiler": "profiling",
+    "writeProfile": "profiling",
+    "followLogs": "follow",
+    "scanStats": "stats",
+    "printScanStats": "stats",
+    "exportEvents": "export",
+    "searchArchives": "archives",
+}
+
+__all__ = list(exports)
+
+def __getattr__(name):
+    if name not in exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module("." + exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
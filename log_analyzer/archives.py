@@ -0,0 +1,106 @@
+# --cdts: searching many CDT zips at once, skipping the ones already searched
+
+import os
+import json
+import hashlib
+import logging
+import concurrent.futures
+
+from .searcher import Searcher, extractCDT
+from .logfiles import fileFingerprint
+from .settings import CDTDoneFile, CDTSummaryFile
+
+def CDTArchives(paths):
+    '''Full paths of the CDT zips given to --cdts as files or folders containing them'''
+    archives = []
+    for path in paths:
+        if os.path.isdir(path):
+            archives += sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(".zip"))
+        else:
+            archives.append(path)
+    return list(dict.fromkeys(os.path.abspath(path) for path in archives))
+
+def archiveHash(path):
+    '''SHA-256 of a file's content'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def CDTDoneRecord(searcher):
+    try:
+        with open(searcher.outputDir + CDTDoneFile, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def extractArchive(path, query, useCache=True):
+    '''Extraction stage of --cdts, run on a thread. Returns (content hash, summary of the earlier search of the CDT
+    for the same query or None), extracting the CDT if it still has to be searched. Without useCache the CDT is
+    always searched again.'''
+    searcher = Searcher(os.path.dirname(path), os.path.basename(path))
+    done = CDTDoneRecord(searcher) if useCache else {}
+    # The zip is only hashed again when it changed since it was last searched
+    if done.get("fingerprint") == fileFingerprint(path):
+        content_hash = done["hash"]
+    else:
+        content_hash = archiveHash(path)
+    if done.get("hash") == content_hash and done.get("query") == query:
+        return content_hash, done["summary"]
+    extractCDT(path, searcher.workingDir + searcher.CDTfolder)
+    return content_hash, None
+
+def searchArchive(path, query, useCache=True):
+    '''Search stage of --cdts, run on a worker process. Writes the results to the output folder of the CDT like a
+    search of a single CDT does, and returns how many messages were found.'''
+    searcher = Searcher(os.path.dirname(path), os.path.basename(path), since=query["since"], until=query["until"])
+    counts = searcher.cachedSearch(query["message_id"], useCache)
+    return dict(counts, output=searcher.outputDir)
+
+def searchArchives(paths, msgID, summaryDir, since=None, until=None, jobs=1, extractJobs=2, useCache=True):
+    '''--cdts: searches every CDT zip in paths for msgID from since to until, and writes a summary to summaryDir.
+    Extraction (disk bound) runs on a pool of extractJobs threads and searching (CPU bound) on a pool of jobs
+    processes; each CDT is handed to the search pool as soon as it is extracted, so the two overlap. CDTs whose zip
+    content (SHA-256) was already searched with the same message ID and since/until are skipped, unless useCache is
+    False.'''
+    query = {"message_id": msgID, "since": since, "until": until}
+    archives = CDTArchives(paths)
+    logging.info(f"Searching {len(archives)} CDT(s) for '{msgID}'")
+    summary = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=extractJobs) as extractors, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as searchers:
+        extractions = {extractors.submit(extractArchive, path, query, useCache): path for path in archives}
+        searches = {}
+        for future in concurrent.futures.as_completed(extractions):
+            path = extractions[future]
+            try:
+                content_hash, cached = future.result()
+            except Exception as e:
+                logging.error(f"Could not extract {path}: {e!r}")
+                summary[path] = {"error": repr(e)}
+                continue
+            if cached is not None:
+                logging.info(f"{path} was already searched for '{msgID}', skipping it")
+                summary[path] = dict(cached, cached=True)
+                continue
+            searches[searchers.submit(searchArchive, path, query, useCache)] = (path, content_hash)
+
+        for future in concurrent.futures.as_completed(searches):
+            path, content_hash = searches[future]
+            try:
+                summary[path] = future.result()
+            except Exception as e:
+                logging.error(f"Could not search {path}: {e!r}")
+                summary[path] = {"error": repr(e)}
+                continue
+            logging.info(f"{path}: {summary[path]['messages']} IMSS message(s), "
+                         f"{summary[path]['maillog_messages']} maillog message(s)")
+            with open(summary[path]["output"] + CDTDoneFile, "w") as f:
+                json.dump({"fingerprint": fileFingerprint(path), "hash": content_hash, "query": query,
+                           "summary": summary[path]}, f, indent=2)
+
+    summary = {path: summary[path] for path in archives}
+    with open(os.path.join(summaryDir, CDTSummaryFile), "w") as f:
+        json.dump({"query": query, "cdts": summary}, f, indent=2)
+    return summary
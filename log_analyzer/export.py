@@ -0,0 +1,157 @@
+# --export: every log.imss and maillog line of a CDT as rows of an SQLite database or Parquet files
+
+import os
+import re
+import logging
+import sqlite3
+import itertools
+
+from .profiling import profiled
+from .logfiles import readLines, listFiles, fileFingerprint, fileLastWritten, IMSSLocalTime, maillogTime, \
+    queueIDexp, queuedAsLineExp
+from .settings import ExportDatabaseFile, ExportParquetFiles, exportBatchSize
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # only needed for --export parquet
+
+# Columns of the exported rows; the log line itself is not stored, it can be read back from file and byte_offset
+exportColumns = {
+    "imss_events": [("time", "TEXT"), ("timezone", "TEXT"), ("process_id", "TEXT"), ("event", "TEXT"),
+                    ("external_id", "TEXT"), ("internal_id", "TEXT"), ("file", "TEXT"), ("byte_offset", "INTEGER"),
+                    ("length", "INTEGER")],
+    "maillog_events": [("time", "TEXT"), ("host", "TEXT"), ("service", "TEXT"), ("pid", "INTEGER"),
+                       ("queue_id", "TEXT"), ("message_id", "TEXT"), ("from_address", "TEXT"), ("to_address", "TEXT"),
+                       ("relay", "TEXT"), ("status", "TEXT"), ("queued_as", "TEXT"), ("file", "TEXT"),
+                       ("byte_offset", "INTEGER"), ("length", "INTEGER")],
+}
+exportIndexes = {
+    "imss_events": [["external_id"], ["internal_id"], ["process_id", "time"], ["time"], ["file"]],
+    "maillog_events": [["queue_id"], ["message_id"], ["queued_as"], ["time"], ["file"]],
+}
+
+# from=<...>, to=<...>, relay=..., status=..., message-id=<...> fields of a Postfix line
+maillogFieldExp = re.compile(r'\b(from|to|relay|status|message-id)=(<[^>]*>|[^,\s]+)')
+
+def IMSSEventRows(folder, file):
+    '''Yields an imss_events row (see exportColumns) for every line of the log.imss file in folder'''
+    for offset, line in readLines(folder + file):
+        line = line.decode("latin-1")
+        fields = line.split()
+        time = IMSSLocalTime(line)
+        event = "log"
+        external_ID = internal_ID = None
+        if time is None:
+            yield [None, None, None, event, None, None, file, offset, len(line)]
+            continue
+        # 2021/11/05 13:12:18 GMT-03:00 [24790:3979802368] [I]>>> Message-ID : <abc@astound.net>
+        if "Start Rule Set Retrieval spent" in line:
+            event = "scan_start"
+        elif ">>> Message-ID : <" in line and len(fields) > 7:
+            event = "message_id"
+            external_ID = fields[7].strip("<>")
+        elif "Scan finished for" in line and len(fields) > 7:
+            event = "scan_finished"
+            internal_ID = fields[7].strip(",")
+        yield [time, fields[2], fields[3] if len(fields) > 3 else None, event, external_ID, internal_ID, file, offset,
+               len(line)]
+
+def maillogEventRows(folder, file):
+    '''Yields a maillog_events row (see exportColumns) for every line of the maillog file in folder'''
+    lastWritten = fileLastWritten(folder + file)
+    for offset, line in readLines(folder + file):
+        line = line.decode("latin-1")
+        # Nov  5 13:12:19 IMSVA9-1chile postfix/smtp[24767]: 935162C03E: to=<joelg@joelg.com>, relay=...
+        fields = line.split(None, 6)
+        host = service = pid = queue_ID = None
+        if len(fields) > 4:
+            host = fields[3]
+            service, _, pid = fields[4].rstrip(":").partition("[")
+            pid = int(pid.rstrip("]")) if pid.rstrip("]").isdigit() else None
+        if len(fields) > 5 and queueIDexp.match(fields[5].rstrip(":")):
+            queue_ID = fields[5].rstrip(":")
+        values = {key: value.strip("<>") for key, value in maillogFieldExp.findall(line)}
+        queued_as = queuedAsLineExp.search(line)
+        yield [maillogTime(line, lastWritten), host, service, pid, queue_ID, values.get("message-id"),
+               values.get("from"), values.get("to"), values.get("relay"), values.get("status"),
+               queued_as.group(1) if queued_as else None, file, offset, len(line)]
+
+def exportFiles(searcher):
+    '''(table, folder, log files, row function) of the log files of the CDT of searcher'''
+    return [("imss_events", searcher.IMSSFolder, listFiles(searcher.IMSSFolder, "log.imss*"), IMSSEventRows),
+            ("maillog_events", searcher.maillogFolder, listFiles(searcher.maillogFolder, "maillog*"), maillogEventRows)]
+
+def exportSQLite(searcher):
+    '''--export: writes a row per log line to an SQLite database in the outputDir of searcher, indexed on message ID,
+    queue ID and time. Rows of log files whose size/mtime did not change since the last export are kept as they are.
+    Example query: SELECT * FROM maillog_events WHERE message_id LIKE '%@astound.net' ORDER BY time'''
+    os.makedirs(searcher.outputDir, exist_ok=True)
+    db = sqlite3.connect(searcher.outputDir + ExportDatabaseFile)
+    try:
+        # The database can be exported again from the logs, so speed matters more than surviving a crash
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("PRAGMA journal_mode = MEMORY")
+        db.execute("CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, tbl TEXT, size INTEGER, mtime_ns INTEGER)")
+        for table, columns in exportColumns.items():
+            db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{name} {kind}' for name, kind in columns)})")
+        exported = {file: [size, mtime_ns] for file, size, mtime_ns in db.execute("SELECT file, size, mtime_ns FROM files")}
+
+        for table, folder, files, rows in exportFiles(searcher):
+            # Forget about log files that were removed from the CDT folder
+            for file in db.execute("SELECT file FROM files WHERE tbl = ?", (table,)).fetchall():
+                if file[0] not in files:
+                    db.execute(f"DELETE FROM {table} WHERE file = ?", file)
+                    db.execute("DELETE FROM files WHERE file = ?", file)
+            for file in files:
+                fingerprint = fileFingerprint(folder + file)
+                if exported.get(file) == fingerprint:
+                    continue
+                logging.info(f"Exporting {file} to {ExportDatabaseFile}...")
+                with db:
+                    db.execute(f"DELETE FROM {table} WHERE file = ?", (file,))
+                    insert = f"INSERT INTO {table} VALUES ({', '.join('?' * len(exportColumns[table]))})"
+                    lines = rows(folder, file)
+                    while True:
+                        batch = list(itertools.islice(lines, exportBatchSize))
+                        if not batch:
+                            break
+                        db.executemany(insert, batch)
+                    db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (file, table, *fingerprint))
+
+        # Indexes are created after the rows are in, which is quicker than updating them for every row
+        with db:
+            for table, indexes in exportIndexes.items():
+                for columns in indexes:
+                    db.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+        for table in exportColumns:
+            logging.info(f"{db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} rows in {table}")
+    finally:
+        db.close()
+    return searcher.outputDir + ExportDatabaseFile
+
+def exportParquet(searcher):
+    '''--export parquet: writes the same rows as exportSQLite() to a Parquet file per table in the outputDir of
+    searcher, which tools like DuckDB or pandas can query and filter on any column'''
+    if pyarrow is None:
+        raise RuntimeError("--export parquet needs the pyarrow package (pip install pyarrow)")
+    os.makedirs(searcher.outputDir, exist_ok=True)
+    types = {"TEXT": pyarrow.string(), "INTEGER": pyarrow.int64()}
+    for table, folder, files, rows in exportFiles(searcher):
+        columns = exportColumns[table]
+        schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+        with pyarrow.parquet.ParquetWriter(searcher.outputDir + ExportParquetFiles[table], schema) as writer:
+            for file in files:
+                logging.info(f"Exporting {file} to {ExportParquetFiles[table]}...")
+                lines = rows(folder, file)
+                while True:
+                    batch = list(itertools.islice(lines, exportBatchSize))
+                    if not batch:
+                        break
+                    writer.write_table(pyarrow.table([list(column) for column in zip(*batch)], schema=schema))
+    return [searcher.outputDir + name for name in ExportParquetFiles.values()]
+
+@profiled("export")
+def exportEvents(searcher, kind="sqlite"):
+    return exportParquet(searcher) if kind == "parquet" else exportSQLite(searcher)
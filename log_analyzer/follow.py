@@ -0,0 +1,152 @@
+# --follow: reports the messages matching a message ID as they are logged
+
+import os
+import re
+import time
+import signal
+import logging
+import threading
+from datetime import datetime
+
+from .logfiles import listFiles, lastLineEnd
+from .indexes import loadIndex, saveIndex, indexIMSSFile, indexMaillogFile, searchFile
+from .settings import IMSSIndexFile, MaillogIndexFile, FollowStateFile, followInterval, followSaveInterval
+
+def extendIndex(index, file, start, entries, fingerprint):
+    '''Adds the entries an index function (indexIMSSFile(), indexMaillogFile()) found from byte start of file to a
+    loaded index, if the index covered the file up to start. Otherwise the file is left for updateIndex() to redo.'''
+    indexed = index.get(file)
+    if start == 0:
+        index[file] = {"fingerprint": fingerprint, "entries": entries}
+    elif indexed and indexed["fingerprint"][0] == start:
+        if isinstance(entries, dict):
+            for key, values in entries.items():
+                indexed["entries"].setdefault(key, []).extend(values)
+        else:
+            indexed["entries"] += entries
+        indexed["fingerprint"] = fingerprint
+
+class LogFollower(object):
+    '''Keeps track of how far the log files matching pattern in folder were read, so poll() returns only the lines
+    appended since. Files are followed by inode: a file renamed by log rotation carries on from where it was under
+    its new name, and a file that got shorter (truncated by rotation) is read again from its start.
+    state ({file: [inode, offset]}) and index (the saved index of the files) are kept up to date in place.'''
+
+    def __init__(self, folder, pattern, state, index):
+        self.folder = folder
+        self.pattern = pattern
+        self.state = state
+        self.index = index
+        # Files seen for the first time are only read from where their saved index ends, and only lines logged
+        # after following started are reported
+        self.startOffsets = {}
+        self.reportFrom = {}
+        inodes = {inode for inode, offset in state.values()}
+        for file in listFiles(folder, pattern):
+            st = os.stat(folder + file)
+            if st.st_ino not in inodes:
+                indexed = index.get(file)
+                indexed = indexed and indexed["fingerprint"] == [st.st_size, st.st_mtime_ns]
+                self.startOffsets[st.st_ino] = st.st_size if indexed else 0
+                self.reportFrom[file] = st.st_size
+
+    def path(self, file):
+        return self.folder + file
+
+    def poll(self):
+        '''Returns [(file, start, end, fingerprint)] for the complete lines appended to the files since the last poll,
+        end being the byte offset after the last of them'''
+        tracked = {inode: (file, offset) for file, (inode, offset) in self.state.items()}
+        state, renamed, changes = {}, {}, []
+        for file in listFiles(self.folder, self.pattern):
+            try:
+                st = os.stat(self.path(file))
+            except FileNotFoundError:
+                continue  # rotated away since the glob
+            old_file, offset = tracked.get(st.st_ino, (file, self.startOffsets.pop(st.st_ino, 0)))
+            if old_file != file:
+                logging.info(f"{old_file} was renamed to {file}")
+                if old_file in self.index:
+                    renamed[file] = self.index.pop(old_file)
+                self.reportFrom[file] = self.reportFrom.pop(old_file, 0)
+            if st.st_size < offset:
+                logging.info(f"{file} was truncated, reading it again from the start")
+                offset = 0
+                self.reportFrom.pop(file, None)
+            end = lastLineEnd(self.path(file), offset, st.st_size)
+            if end > offset:
+                # The index only stays valid for updateIndex() while the file has no partial last line
+                changes.append((file, offset, end, [end, st.st_mtime_ns if end == st.st_size else None]))
+            state[file] = [st.st_ino, end]
+        self.index.update(renamed)
+        # Forget about log files that were removed
+        for file in list(self.index):
+            if file not in state:
+                del self.index[file]
+        self.state.clear()
+        self.state.update(state)
+        return changes
+
+def followLogs(searcher, msgID):
+    '''--follow: checks the log.imss and maillog files of the CDT of searcher every followInterval seconds and prints
+    the new Message-ID and message-id lines matching msgID. Only the bytes appended since the last check are read,
+    and they are added to the saved Message-ID and queue ID indexes as they come in. The read offsets are saved as
+    well, so a later --follow carries on where this one stopped, whether it is stopped by Ctrl+C or by SIGTERM
+    (systemd, kill, timeout).'''
+    exp = re.compile(msgID, re.IGNORECASE)
+    maillog_exp = re.compile(rf'message-id=<\S*{msgID}\S*', re.IGNORECASE)
+    state = loadIndex(searcher.outputDir + FollowStateFile)
+    imss_index = loadIndex(searcher.outputDir + IMSSIndexFile)
+    maillog_index = loadIndex(searcher.outputDir + MaillogIndexFile)
+    imss = LogFollower(searcher.IMSSFolder, "log.imss*", state.setdefault("imss", {}), imss_index)
+    maillog = LogFollower(searcher.maillogFolder, "maillog*", state.setdefault("maillog", {}), maillog_index)
+
+    def save():
+        saveIndex(searcher.outputDir + IMSSIndexFile, imss_index)
+        saveIndex(searcher.outputDir + MaillogIndexFile, maillog_index)
+        saveIndex(searcher.outputDir + FollowStateFile, state)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # SIGTERM ends the process without running the finally below, so it stops following like Ctrl+C does.
+    # Signal handlers can only be set from the main thread.
+    terminate = None
+    if threading.current_thread() is threading.main_thread():
+        terminate = signal.signal(signal.SIGTERM, stop)
+
+    logging.info(f"Following log.imss and maillog files for '{msgID}', press Ctrl+C to stop")
+    saved = datetime.now()
+    try:
+        while True:
+            for file, start, end, fingerprint in imss.poll():
+                entries = indexIMSSFile(imss.path(file), start, end)
+                extendIndex(imss_index, file, start, entries, fingerprint)
+                hits = [entry for entry in entries
+                        if entry[1] >= imss.reportFrom.get(file, 0) and exp.search(entry[0])]
+                if hits:
+                    with open(imss.path(file), "r", encoding="latin-1") as f:
+                        for externalID, offset, IMSSprocID, timestamp in hits:
+                            f.seek(offset)
+                            line = f.readline()
+                            logging.debug(f"{file}: {line.rstrip()}")
+                            print(f"{file}: {line}", end="", flush=True)
+
+            for file, start, end, fingerprint in maillog.poll():
+                extendIndex(maillog_index, file, start, indexMaillogFile(maillog.path(file), start, end), fingerprint)
+                for offset, line in searchFile(maillog.path(file), maillog_exp.pattern, maillog_exp.flags,
+                                               b"message-id=<", start, end):
+                    if offset >= maillog.reportFrom.get(file, 0):
+                        logging.debug(f"{file}: {line.rstrip()}")
+                        print(f"{file}: {line}", end="", flush=True)
+
+            if datetime.now() - saved >= followSaveInterval:
+                save()
+                saved = datetime.now()
+            time.sleep(followInterval)
+    except KeyboardInterrupt:
+        logging.info("Stopped following the logs")
+    finally:
+        save()
+        if terminate is not None:
+            signal.signal(signal.SIGTERM, terminate)
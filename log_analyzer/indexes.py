@@ -0,0 +1,241 @@
+# Indexes of the log files (message IDs, queue IDs, internal IDs, time samples), saved as JSON next to the results
+# and only rebuilt for the log files that changed
+
+import os
+import re
+import json
+import bisect
+import logging
+from datetime import datetime, timedelta
+
+from .profiling import profiler
+from .logfiles import readLines, mapFile, findLines, fileFingerprint, pathLock, queueIDexp, queuedAsExp, \
+    IMSSLocalTime, fileLastWritten, maillogTime
+from .settings import scanChunkSize, timeSampleSize
+
+# Internal message IDs are UUIDs
+internalIDExp = re.compile(rb'\b[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}\b')
+
+loadedIndexes = {}  # index path: (fingerprint of the index file, index), so repeat searches don't parse it again
+
+def loadIndex(path):
+    '''Returns the index saved at path, or {} if it does not exist or can't be read. An index is kept in memory once
+    loaded and only read again when its file changes.'''
+    try:
+        fingerprint = fileFingerprint(path)
+        if path in loadedIndexes and loadedIndexes[path][0] == fingerprint:
+            return loadedIndexes[path][1]
+        with open(path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.debug(f"Index {path} not loaded: {e}")
+        return {}
+    loadedIndexes[path] = (fingerprint, index)
+    return index
+
+def saveIndex(path, index):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so an interrupted run never leaves a half written index behind
+    with pathLock(path):
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+        loadedIndexes[path] = (fileFingerprint(path), index)
+
+def scanFiles(scanFile, folder, files, *args, jobs=1, split=True, ranges=None):
+    '''Runs scanFile(path, *args, start=, end=) on every file in folder and returns {file: result} in the same order
+    as files. With jobs above 1 the files are scanned on that many processes, and files over scanChunkSize are split
+    into byte ranges whose results are joined back in file order (lists are concatenated, dicts of lists are
+    extended). Use split=False for scans that need the whole file. ranges ({file: (start, end)}, see
+    Searcher.timeWindowRanges()) limits the scan of a file to that byte range.'''
+    parts = []  # (file, path, start, end) of each scan
+    for file in files:
+        path = os.path.join(folder, file)
+        start, end = ranges.get(file, (0, None)) if ranges else (0, None)
+        size = os.path.getsize(path) if end is None else end
+        if split and jobs > 1 and size - start > scanChunkSize:
+            parts += [(file, path, pos, min(pos + scanChunkSize, size)) for pos in range(start, size, scanChunkSize)]
+        else:
+            parts.append((file, path, start, end))
+
+    if jobs > 1 and len(parts) > 1:
+        import concurrent.futures  # only needed with more than one job, and slow to import
+        logging.info(f"Scanning {len(files)} file(s) in {len(parts)} part(s) on {jobs} processes...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(profiledScan, scanFile, path, *args, start=start, end=end)
+                       for file, path, start, end in parts]
+            results = []
+            for future in futures:
+                part, counters = future.result()
+                results.append(part)
+                profiler.addCounts(counters)
+    else:
+        results = [scanFile(path, *args, start=start, end=end) for file, path, start, end in parts]
+
+    joined = {}
+    for (file, path, start, end), part in zip(parts, results):
+        if file not in joined:
+            joined[file] = part
+        elif isinstance(part, dict):
+            for key, values in part.items():
+                joined[file].setdefault(key, []).extend(values)
+        else:
+            joined[file] += part
+    return joined
+
+def profiledScan(scanFile, *args, **kwargs):
+    '''Runs scanFile on a worker process of scanFiles() and returns its result with the --profile counts it added'''
+    profiler.takeCounts()
+    return scanFile(*args, **kwargs), profiler.takeCounts()
+
+def updateIndex(path, folder, files, indexFile, jobs=1, split=True, ranges=None):
+    '''Loads the index saved at path and runs indexFile(file) for every file in folder that is new or whose size/mtime
+    changed since the index was saved. Returns {file: {"fingerprint": [size, mtime], "entries": ...}}.
+    jobs and split are passed on to scanFiles(). With ranges, files that need indexing are only indexed in their byte
+    range (see Searcher.timeWindowRanges()) and that part of the index is used for this search without being saved.
+    Searches on other threads wait while the index is updated, instead of indexing the same files again.'''
+    with pathLock(path):
+        index = loadIndex(path)
+        fingerprints = {file: fileFingerprint(os.path.join(folder, file)) for file in files}
+        stale_files = [file for file in files if file not in index or index[file]["fingerprint"] != fingerprints[file]]
+        if ranges is not None:
+            if stale_files:
+                logging.info(f"Indexing {', '.join(stale_files)} from --since to --until...")
+            partial = {file: {"fingerprint": None, "entries": entries} for file, entries in
+                       scanFiles(indexFile, folder, stale_files, jobs=jobs, split=split, ranges=ranges).items()}
+            return {file: partial[file] if file in partial else index[file] for file in files}
+        updated = bool(stale_files)
+        if stale_files:
+            logging.info(f"Indexing {', '.join(stale_files)}...")
+        for file, entries in scanFiles(indexFile, folder, stale_files, jobs=jobs, split=split).items():
+            index[file] = {"fingerprint": fingerprints[file], "entries": entries}
+        # Forget about log files that were removed from the CDT folder
+        for file in list(index):
+            if file not in files:
+                del index[file]
+                updated = True
+        if updated:
+            saveIndex(path, index)
+        # Keep the order of files so message numbering does not depend on the index
+        return {file: index[file] for file in files}
+
+def indexIMSSFile(file, start=0, end=None):
+    '''Returns [external ID, byte offset, IMSS process ID, timestamp] for every Message-ID line in a log.imss file'''
+    entries = []
+    with mapFile(file) as mm:
+        for offset, line in findLines(mm, b">>> Message-ID : <", start, end):
+            # 2021/11/05 13:12:18 GMT-03:00 [24790:3979802368] [I]>>> Message-ID : <abc@astound.net>
+            fields = line.decode("latin-1").split()
+            entries.append([fields[7].strip("<>"), offset, fields[3], " ".join(fields[:3])])
+    logging.debug(f"Indexed {len(entries)} message IDs in {file}")
+    return entries
+
+def indexMaillogFile(file, start=0, end=None):
+    '''Returns {queue ID: [byte offsets]} of the lines for each Postfix queue ID in a maillog file.
+    A "status=sent (... queued as X)" line is also listed under X, so the hand-off to the next queue
+    shows up in the maillogs of both queue IDs.'''
+    queue_IDs = {}
+    for offset, line in readLines(file, start, end):
+        # Nov  5 13:12:19 IMSVA9-1chile postfix/smtp[24767]: 935162C03E: to=<joelg@joelg.com>, relay=...
+        fields = line.split(None, 6)
+        if len(fields) > 5 and fields[4].startswith(b"postfix") and fields[5].endswith(b":"):
+            queue_ID = fields[5][:-1].decode("latin-1")
+            if queueIDexp.match(queue_ID):
+                queue_IDs.setdefault(queue_ID, []).append(offset)
+                queued_as = queuedAsExp.search(line)
+                if queued_as:
+                    queue_IDs.setdefault(queued_as.group(1).decode("latin-1"), []).append(offset)
+    logging.debug(f"Indexed {len(queue_IDs)} queue IDs in {file}")
+    return queue_IDs
+
+def searchFile(file, pattern, flags=0, marker=None, start=0, end=None):
+    '''Returns [byte offset, line] for every line of file matching the regex pattern. If given, only the lines
+    containing the bytes marker are decoded and checked against the regex.'''
+    exp = re.compile(pattern, flags)
+    if marker is None:
+        return searchLines(exp, readLines(file, start, end))
+    with mapFile(file) as mm:
+        return searchLines(exp, findLines(mm, marker, start, end))
+
+def searchLines(exp, lines):
+    '''Returns [byte offset, line] for each (byte offset, line) of lines where the line matches the regex exp'''
+    result = []
+    evaluations = 0
+    for offset, line in lines:
+        # Use errors="surrogateescape" or encoding="latin-1" for unicode errors
+        line = line.decode("latin-1")
+        evaluations += 1
+        if exp.search(line):
+            result.append([offset, line])
+    profiler.count("regex_evaluations", evaluations)
+    profiler.count("regex_hits", len(result))
+    return result
+
+def indexIMSSInternalIDFile(file, start=0, end=None):
+    '''Returns [internal ID, byte offset, IMSS process ID, timestamp] for every "Scan finished for" line in a log.imss
+    file, the same layout as the Message-ID entries of indexIMSSFile()'''
+    entries = []
+    with mapFile(file) as mm:
+        for offset, line in findLines(mm, b"Scan finished for ", start, end):
+            # 2021/11/05 13:12:20 GMT-03:00 [24790:3979802368] [I]Scan finished for 5A8E2C4D-..., action=deliver
+            fields = line.decode("latin-1").split()
+            if len(fields) > 7:
+                entries.append([fields[7].strip(","), offset, fields[3], " ".join(fields[:3])])
+    logging.debug(f"Indexed {len(entries)} internal IDs in {file}")
+    return entries
+
+def indexPolevtFile(file, start=0, end=None):
+    '''Returns {internal ID: [byte offsets]} of the lines of a polevt policy event log that name each internal ID'''
+    internal_IDs = {}
+    for offset, line in readLines(file, start, end):
+        for internalID in dict.fromkeys(internalIDExp.findall(line)):
+            internal_IDs.setdefault(internalID.decode("latin-1").upper(), []).append(offset)
+    logging.debug(f"Indexed {len(internal_IDs)} internal IDs in {file}")
+    return internal_IDs
+
+def sampleTimes(file, lineTime, start=0, end=None):
+    '''Returns [timestamp, byte offset] of the first line with a timestamp (lineTime(line) is not None) after every
+    timeSampleSize bytes of file. Only a line or two is read at each sample, not the whole file.'''
+    samples = []
+    with open(file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        for pos in range(start, end, timeSampleSize):
+            if pos:
+                # Skip to the first line starting at or after pos
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(0)
+            offset = f.tell()
+            while offset < min(pos + timeSampleSize, size):
+                line = f.readline()
+                time = lineTime(line.decode("latin-1"))
+                if time is not None:
+                    samples.append([time, offset])
+                    break
+                offset += len(line)
+    return samples
+
+def sampleIMSSTimes(file, start=0, end=None):
+    return sampleTimes(file, IMSSLocalTime, start, end)
+
+def sampleMaillogTimes(file, start=0, end=None):
+    lastWritten = fileLastWritten(file)
+    return sampleTimes(file, lambda line: maillogTime(line, lastWritten), start, end)
+
+def timeWindowRange(samples, since=None, until=None, margin=timedelta(0)):
+    '''Returns the byte range (start, end) of a file that holds its lines from since to until, widened by margin,
+    by bisecting the time samples of the file. end is None for the end of the file.'''
+    times = [time for time, offset in samples]
+    start, end = 0, None
+    if since:
+        i = bisect.bisect_left(times, (datetime.fromisoformat(since) - margin).isoformat(" "))
+        # Lines from the window can come right after the last sample before it
+        if i > 0:
+            start = samples[i - 1][1]
+    if until:
+        i = bisect.bisect_right(times, (datetime.fromisoformat(until) + margin).isoformat(" "))
+        if i < len(samples):
+            end = samples[i][1]
+    return start, end
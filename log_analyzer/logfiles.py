@@ -0,0 +1,313 @@
+# Reading log files: line spans, byte range readers, timestamps and the fields of log.imss and maillog lines
+
+import os
+import re
+import glob
+import mmap
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from .profiling import profiler
+
+# Short (hex) and long Postfix queue IDs, so "warning:" or "NOQUEUE:" are not taken for one
+queueIDexp = re.compile(r'^(?:[0-9A-F]{6,}|[0-9B-DF-HJ-NP-TV-Zb-df-hj-np-tv-z]{12,})$')
+
+queuedAsExp = re.compile(rb'status=sent \(.*queued as ([0-9A-Za-z]+)\)')
+queuedAsLineExp = re.compile(queuedAsExp.pattern.decode())
+
+log_files = [None]  # file ID: absolute path of a log file, file ID 0 is for text that is not from a file
+log_file_IDs = {}  # absolute path: file ID
+log_files_lock = threading.Lock()
+
+def fileID(file):
+    '''Returns the file ID used in LogSpans for a log file path'''
+    path = os.path.abspath(file)
+    with log_files_lock:
+        if path not in log_file_IDs:
+            log_file_IDs[path] = len(log_files)
+            log_files.append(path)
+        return log_file_IDs[path]
+
+pathLocks = {}  # path: lock held while the index or cache file at path is updated
+pathLocksLock = threading.Lock()
+
+def pathLock(path):
+    '''Lock for updating the file at path, so searches on several threads don't update it at the same time'''
+    with pathLocksLock:
+        return pathLocks.setdefault(path, threading.RLock())
+
+def listFiles(folder, pattern):
+    '''Sorted names of the files in folder matching the glob pattern'''
+    return sorted(os.path.basename(path) for path in glob.glob(glob.escape(folder) + pattern))
+
+class LogSpans(object):
+    '''List of log lines stored as (file ID, byte offset, length) spans instead of the line text.
+    The lines are read back from the log files when iterated or indexed. Length 0 means read up to the end of the
+    line. Text that is not from a log file (e.g. separators) is kept under file ID 0.'''
+    __slots__ = ("file_IDs", "offsets", "lengths", "texts")
+
+    def __init__(self):
+        self.file_IDs = array("I")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.texts = []
+
+    def append(self, file_ID, offset, length=0):
+        self.file_IDs.append(file_ID)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def appendText(self, text):
+        self.append(0, len(self.texts))
+        self.texts.append(text)
+
+    def extend(self, other):
+        text_offset = len(self.texts)
+        self.texts += other.texts
+        self.file_IDs += other.file_IDs
+        self.offsets += array("Q", (offset + text_offset if file_ID == 0 else offset
+                                    for file_ID, offset in zip(other.file_IDs, other.offsets)))
+        self.lengths += other.lengths
+        return self
+
+    def select(self, keep):
+        '''Returns a new LogSpans with only the lines for which keep(line) is true'''
+        selected = LogSpans()
+        for i, line in enumerate(self):
+            if keep(line):
+                selected.extend(self[i:i + 1])
+        return selected
+
+    def __add__(self, other):
+        return LogSpans().extend(self).extend(other)
+
+    def __len__(self):
+        return len(self.file_IDs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            spans = LogSpans()
+            spans.file_IDs, spans.offsets, spans.lengths = self.file_IDs[i], self.offsets[i], self.lengths[i]
+            spans.texts = self.texts
+            return spans
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("LogSpans index out of range")
+        return next(iter(self[i:i + 1]))
+
+    def __iter__(self):
+        files = {}  # file ID: open file, so each file is opened once per pass
+        read = 0
+        try:
+            for file_ID, offset, length in zip(self.file_IDs, self.offsets, self.lengths):
+                if file_ID == 0:
+                    yield self.texts[offset]
+                    continue
+                if file_ID not in files:
+                    files[file_ID] = open(log_files[file_ID], "rb")
+                f = files[file_ID]
+                f.seek(offset)
+                # Use encoding="latin-1" for unicode errors
+                line = f.read(length) if length else f.readline()
+                read += len(line)
+                yield line.decode("latin-1")
+        finally:
+            for f in files.values():
+                f.close()
+            profiler.count("files_opened", len(files))
+            profiler.count("bytes_read", read)
+
+    def __repr__(self):
+        return f"LogSpans({len(self)} lines)"
+
+def fileFingerprint(file):
+    '''Size and mtime of a log file, used to tell if an index entry for the file is still valid'''
+    st = os.stat(file)
+    return [st.st_size, st.st_mtime_ns]
+
+def readLines(file, start=0, end=None):
+    '''Yields (byte offset, line) for every line of file that starts in the byte range [start, end)'''
+    profiler.count("files_opened")
+    with open(file, "rb") as f:
+        if start:
+            # The line running over start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        offset = first = f.tell()
+        lines = 0
+        try:
+            for line in f:
+                if end is not None and offset >= end:
+                    break
+                yield offset, line
+                offset += len(line)
+                lines += 1
+        finally:
+            profiler.count("bytes_read", offset - first)
+            profiler.count("lines_scanned", lines)
+
+@contextmanager
+def mapFile(file):
+    '''Memory-maps a log file read-only. Empty files can't be mapped, so b"" is used for them instead.'''
+    profiler.count("files_opened")
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+def findLines(mm, marker, start=0, end=None):
+    '''Yields (byte offset, line) for every line of a mapped file that contains the bytes marker and starts in the
+    byte range [start, end). Only the lines around a hit of the literal marker are sliced out of the map, so the
+    (regex) checks on those lines skip all the lines that can't match.'''
+    size = len(mm)
+    if end is None or end > size:
+        end = size
+    if start >= end:
+        return
+    # No line starting in the range goes past the end of the line running over end, so don't search further
+    limit = mm.find(b"\n", end - 1)
+    limit = size if limit == -1 else limit + 1
+    pos = start
+    lines = 0
+    try:
+        while True:
+            hit = mm.find(marker, pos, limit)
+            if hit == -1:
+                pos = limit
+                break
+            line_start = mm.rfind(b"\n", 0, hit) + 1
+            if line_start >= end:
+                break
+            line_end = mm.find(b"\n", hit)
+            line_end = size if line_end == -1 else line_end + 1
+            # A line running over start belongs to the previous range
+            if line_start >= start:
+                lines += 1
+                yield line_start, mm[line_start:line_end]
+            pos = line_end
+    finally:
+        # Only the lines with the marker are scanned, but the map is read all the way through the range
+        profiler.count("bytes_read", pos - start)
+        profiler.count("lines_scanned", lines)
+
+def lastLineEnd(file, start, end):
+    '''Returns the byte offset after the last newline in the byte range [start, end) of file, start if there is none'''
+    with open(file, "rb") as f:
+        pos = end
+        while pos > start:
+            block = min(pos - start, 64 * 1024)
+            f.seek(pos - block)
+            i = f.read(block).rfind(b"\n")
+            if i != -1:
+                return pos - block + i + 1
+            pos -= block
+    return start
+
+def lineQueueID(line):
+    '''Returns the Postfix queue ID of a maillog line, or "" if it does not have one'''
+    # Nov  5 13:12:19 IMSVA9-1chile postfix/smtp[24767]: 935162C03E: to=<joelg@joelg.com>, relay=...
+    fields = line.split(None, 6)
+    return fields[5].rstrip(":") if len(fields) > 5 else ""
+
+IMSStimezones = {}  # "GMT-03:00": timezone object
+IMSStimes = {}  # timestamp text: datetime, for the seconds already parsed
+
+def hasIMSSTime(line):
+    '''True if the line starts with a timestamp in the usual log.imss layout'''
+    # 2021/11/05 13:12:18 GMT-03:00
+    return len(line) > 29 and line[4] == line[7] == "/" and line[13] == line[16] == line[26] == ":" \
+        and line[23] in "+-" and line[10] == line[19] == " " and line[29].isspace()
+
+def parseIMSSTime(line):
+    '''Returns the ‘YYYY/MM/DD HH:MM:SS GMT-00:00‘ timestamp at the start of a log.imss line as a datetime.
+    Same result as datetime.strptime(' '.join(line.split()[:3]), '%Y/%m/%d %H:%M:%S %Z%z') but reads the fixed
+    positions of the fields and remembers each second it has seen, because strptime is slow on busy process IDs.'''
+    stamp = line[:29]
+    time = IMSStimes.get(stamp)
+    if time is not None:
+        return time
+
+    if hasIMSSTime(line):
+        tz = IMSStimezones.get(stamp[20:])
+        if tz is None:
+            offset = timedelta(hours=int(stamp[24:26]), minutes=int(stamp[27:29]))
+            tz = timezone(-offset if stamp[23] == "-" else offset, stamp[20:23])
+            IMSStimezones[stamp[20:]] = tz
+        time = datetime(int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                        int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]), tzinfo=tz)
+    else:
+        # Timestamp not in the usual layout, let strptime deal with it
+        return datetime.strptime(' '.join(line.split()[:3]), '%Y/%m/%d %H:%M:%S %Z%z')
+
+    if len(IMSStimes) > 100000:
+        IMSStimes.clear()
+    IMSStimes[stamp] = time
+    return time
+
+def IMSSLocalTime(line):
+    '''Returns the timestamp of a log.imss line as "YYYY-MM-DD HH:MM:SS" local time, None if it has none'''
+    if not hasIMSSTime(line):
+        return None
+    return f"{line[0:4]}-{line[5:7]}-{line[8:10]} {line[11:19]}"
+
+syslogMonths = {month: i for i, month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+
+def fileLastWritten(file):
+    return datetime.fromtimestamp(os.path.getmtime(file))
+
+def maillogTime(line, lastWritten):
+    '''Returns the syslog timestamp of a maillog line as "YYYY-MM-DD HH:MM:SS", None if it has none.
+    Syslog leaves out the year, so it is taken from lastWritten (see fileLastWritten()), the time the file was last
+    written: months after that month are from the year before, when the file ran over New Year.'''
+    # Nov  5 13:12:19 IMSVA9-1chile postfix/smtp[24767]: ...
+    month = syslogMonths.get(line[:3])
+    if month is None or len(line) < 15 or not (line[3] == line[6] == " " and line[9] == line[12] == ":") \
+            or not line[4:6].strip().isdigit():
+        return None
+    year = lastWritten.year - (month > lastWritten.month)
+    return f"{year:04d}-{month:02d}-{int(line[4:6]):02d} {line[7:15]}"
+
+def windowTime(text):
+    '''Reads a --since/--until time as "YYYY-MM-DD HH:MM:SS" text, which sorts the same way as the times'''
+    try:
+        return datetime.fromisoformat(text.replace("/", "-")).replace(tzinfo=None).isoformat(" ")
+    except ValueError:
+        raise ValueError(f"invalid time '{text}', expected 'YYYY-MM-DD HH:MM[:SS]'")
+
+def IMSSFileTimeRange(file, start=0, end=None):
+    '''Returns the timestamp text of the first and last line of a log.imss file, [None, None] if it has none'''
+    first = last = None
+    with open(file, "rb") as f:
+        for line in f:
+            if hasIMSSTime(line.decode("latin-1")):
+                first = line[:29].decode("latin-1")
+                break
+        # The last timestamp is near the end, read backwards a block at a time until a line has one
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while first and last is None and pos > 0:
+            block = min(pos, 64 * 1024)
+            pos -= block
+            f.seek(pos)
+            tail = f.read(block) + tail
+            # The first line in the block may be cut off unless the block starts the file
+            for line in reversed(tail.splitlines()[(1 if pos else 0):]):
+                if hasIMSSTime(line.decode("latin-1") + "\n"):
+                    last = line[:29].decode("latin-1")
+                    break
+    return [first, last]
+
+def IMSSFileOrder(file):
+    '''Sort key for rotated log.imss.YYYYMMDD.NNNN files, which must not be sorted as text once NNNN > 9999'''
+    match = re.match(r'log\.imss\.(\d{8})\.(\d+)$', file)
+    if match:
+        return (match.group(1), int(match.group(2)), file)
+    # Current log.imss file without a date comes after all rotated files
+    return ("99999999", 0, file)
@@ -0,0 +1,585 @@
+# Messages found in the logs, and extracting their log.imss and maillog lines
+
+import os
+import bisect
+import logging
+import collections
+
+from .profiling import profiler, profiled
+from .logfiles import LogSpans, fileID, readLines, mapFile, findLines, listFiles, lineQueueID, queuedAsLineExp, \
+    parseIMSSTime, IMSSFileTimeRange, IMSSFileOrder, fileFingerprint
+from .indexes import updateIndex, loadIndex, sampleIMSSTimes, timeWindowRange
+from .settings import IMSSTimeRangeFile, IMSSTimeIndexFile, IMSSInternalIDIndexFile, maxScanTime, \
+    maxProcessIDSearches
+
+class Message(object):
+    # Slots instead of a __dict__ per message, and no class level lists shared by all messages
+    __slots__ = ("id", "start_scan_time", "end_scan_time", "IMSSprocID", "externalID", "internalIDs",
+                 "IMSS_log_file", "IMSS_log_offset", "maillogQueueIDs", "relatedQueueIDs", "maillog_file", "maillogs",
+                 "IMSSLogs", "policyEvents")
+    '''
+    # The class "constructor" - It's actually an initializer
+    def __init__(self, date_time, IMSSprocID, externalID):
+        self.date_time = datetime
+        self.IMSSprocID = IMSSprocID
+        self.externalID = externalID
+    '''
+
+    def __init__(self):
+        self.id = ""
+        self.start_scan_time = ""
+        self.end_scan_time = ""
+        self.IMSSprocID = ""
+        self.externalID = ""
+        self.internalIDs = []
+        self.IMSS_log_file = ""
+        self.IMSS_log_offset = None  # byte offset of the Message-ID line in IMSS_log_file
+        self.maillogQueueIDs = ""
+        self.relatedQueueIDs = []
+        self.maillog_file = ""
+        self.maillogs = None  # LogSpans, set by getMaillogs() or combineMaillogMessages()
+        self.IMSSLogs = None  # LogSpans, set by getIMSSLogsBatch()
+        self.policyEvents = None  # LogSpans of the polevt lines for internalIDs, set by Searcher.correlateMessages()
+
+    def addMaillogs(self, other):
+        '''
+        Related object "other" will be the one that occurs first
+        :param other: message object with same message ID as self
+        :return: None; add maillogs
+        '''
+        if self.externalID != other.externalID:
+            raise ValueError("Message objects do not have the same external ID")
+        else:
+            separator = LogSpans()
+            separator.appendText("----------- sent to IMSS ------------\n")
+            self.maillogs = other.maillogs + separator + self.maillogs
+
+    def toDict(self):
+        '''Message attributes as a dict, with the log lines read back from the log files'''
+        return {name: list(getattr(self, name)) if isinstance(getattr(self, name), LogSpans) else getattr(self, name)
+                for name in self.__slots__}
+
+class Maillog_Message(Message):
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        super().__init__()
+
+class IMSS_Message(Message):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+
+def newIMSSMessage(message_id, file, entry):
+    '''Makes a Message for a Message-ID line in a log.imss file from its index entry, see indexIMSSFile()'''
+    message = Message()
+    message.id = message_id
+    message.externalID = entry[0]
+    message.IMSSprocID = entry[2]
+    message.IMSS_log_file = file
+    message.IMSS_log_offset = entry[1]
+    return message
+
+def maillogExternalID(line):
+    '''Returns the external ID of a "message-id=<...>" maillog line'''
+    # Nov  5 13:12:18 IMSVA9-1chile postfix/cleanup[24766]: 935162C03E: message-id=<abc@astound.net>
+    return line.split()[6].split("=", 1)[-1].strip("<>")
+
+def newMaillogMessage(message_id, file, line):
+    '''Makes a Message for a "message-id=<...>" line in a maillog file'''
+    message = Message()
+    message.id = message_id
+    message.externalID = maillogExternalID(line)
+    message.maillog_file = file
+    message.maillogQueueIDs = line.split()[5].strip(":")
+    return message
+
+@profiled("combineMaillogMessages")
+def combineMaillogMessages(maillog_messages):
+    '''Merges the maillog messages whose queues hand the message on to each other into one message per chain, and
+    returns the merged messages. The chains come from a queue ID graph built in one pass over the maillogs:
+
+    # Example for related queue 935162C03E with primary queue D89812C044
+    # 'Nov  5 13:12:19 IMSVA9-1chile postfix/smtp[24767]: 935162C03E: to=<joelg@joelg.com>,
+    #    relay=localhost[127.0.0.1]:10025, delay=3.5, delays=0.86/0.2/0.37/2.1, dsn=2.0.0,
+    #    status=sent (250 2.0.0 Ok: queued as D89812C044)
+    # 'Nov  5 13:12:20 IMSVA9-1chile postfix/smtp[24794]: D89812C044: Used TLS for 192.168.1.21[192.168.1.21]:25
+
+    Queue IDs are grouped with union-find, so a message that is queued again after IMSS (or any number of
+    times) keeps its whole history, in the order the queues handed it on.'''
+    if not maillog_messages:
+        logging.error("Could not find maillog messages to combine")
+        return None
+
+    parent = {}  # union-find parent of each queue ID
+
+    def find(queue_ID):
+        root = queue_ID
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while queue_ID != root:
+            parent[queue_ID], queue_ID = root, parent[queue_ID]
+        return root
+
+    queued_as = {}  # queue ID: [queue IDs it was queued as]
+    hop_lines = {}  # queue ID: "status=sent (... queued as <queue ID>)" line that handed the message to it
+    for message in maillog_messages:
+        for line in message.maillogs:
+            if "queued as" not in line:
+                continue
+            match = queuedAsLineExp.search(line)
+            if match:
+                queue_ID, next_queue_ID = lineQueueID(line), match.group(1)
+                if next_queue_ID not in hop_lines:
+                    queued_as.setdefault(queue_ID, []).append(next_queue_ID)
+                    hop_lines[next_queue_ID] = line
+                    logging.debug(f"Found related queue ID: {queue_ID} queued as {next_queue_ID}")
+                    parent[find(next_queue_ID)] = find(queue_ID)
+
+    by_queue_ID = {}  # queue ID: first message with it
+    groups = {}  # union-find root: [messages], in maillog_messages order
+    for message in maillog_messages:
+        if by_queue_ID.setdefault(message.maillogQueueIDs, message) is message:
+            groups.setdefault(find(message.maillogQueueIDs), []).append(message)
+
+    merged_messages = []
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        # Walk the chain from the queue IDs that nothing was queued into
+        chain = []
+        stack = [message.maillogQueueIDs for message in reversed(group) if message.maillogQueueIDs not in hop_lines]
+        seen = set()
+        while stack:
+            queue_ID = stack.pop()
+            if queue_ID in seen:
+                continue
+            seen.add(queue_ID)
+            if queue_ID in by_queue_ID:
+                chain.append(queue_ID)
+            stack += reversed(queued_as.get(queue_ID, []))
+        chain += [message.maillogQueueIDs for message in group if message.maillogQueueIDs not in seen]
+
+        merged = Message()
+        merged.id = len(merged_messages) + 1
+        merged.externalID = by_queue_ID[chain[0]].externalID
+        merged.maillog_file = by_queue_ID[chain[0]].maillog_file
+        merged.maillogQueueIDs = chain
+        merged.maillogs = LogSpans()
+        for queue_ID in chain:
+            message = by_queue_ID[queue_ID]
+            message.relatedQueueIDs = [related for related in chain if related != queue_ID]
+            if merged.maillogs:
+                # 10025 is the port IMSS listens on for Postfix
+                hop = "sent to IMSS" if ":10025," in hop_lines.get(queue_ID, "") else f"queued as {queue_ID}"
+                merged.maillogs.appendText(f"----------- {hop} ------------\n")
+            # The hand-off line is listed under both queue IDs, keep it with the queue it belongs to
+            merged.maillogs.extend(message.maillogs.select(lambda line: lineQueueID(line) == queue_ID))
+        merged_messages.append(merged)
+    return merged_messages
+
+@profiled("getMaillogs")
+def getMaillogs(message, index, folder):
+    '''Returns the maillog lines for the message's queue ID as LogSpans, looked up in the queue ID index of the
+    maillog files in folder (see Searcher.getMaillogIndex()). The lines themselves are only read when the results are
+    written.'''
+    result = LogSpans()
+
+    def getLogsByQueueID(queue_id, file):
+        # Will contain all relevant log lines for target queue IDs
+        lines = LogSpans()
+        file_ID = fileID(os.path.join(folder, file))
+        for offset in index[file]["entries"].get(queue_id, []):
+            lines.append(file_ID, offset)
+        if not lines:
+            logging.warning(f"Queue ID {queue_id} not found in {file}")
+        logging.info(f"{len(lines)} lines with queue ID {queue_id} found in file {file}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("".join(lines))
+        return lines
+
+    if message.maillogQueueIDs:
+        logging.debug("Maillogs found:")
+        result.extend(getLogsByQueueID(message.maillogQueueIDs, message.maillog_file))
+    else:
+        logging.error("No maillog files found")
+    if not result:
+        logging.error(f"No maillog queue IDs found for message #{message.id} with external ID {message.externalID}")
+
+    return result
+
+def findProcessLines(mm, IMSSprocID, start=0, end=None):
+    '''Returns [byte offset, line] for the lines of a mapped log.imss file logged by the process ID IMSSprocID, the
+    4th field of the line, that start in the byte range [start, end). Lines that only quote it elsewhere are left out,
+    the same as IMSSProcessLogs does when it picks lines out by that field.'''
+    marker = IMSSprocID.encode("latin-1")
+    return [[offset, line.decode("latin-1")] for offset, line in findLines(mm, marker, start, end)
+            if line.split(None, 4)[3:4] == [marker]]
+
+def getProcessLogsInFile(file, IMSSprocID, msgID, start=0, end=None, lines=None):
+    '''Returns all lines for a process ID in a log.imss file (that start in the byte range [start, end)) as LogSpans,
+    plus [time, line number] lists of the message starts, message ID lines and message ends found in them.
+    Pass lines ([byte offset, line] list) if the process lines were already read from file.'''
+    # Lists of line numbers containing message starts, IDs, and ends.
+    message_starts = []
+    message_ends = []
+    message_IDs = []
+
+    if lines is None:
+        # log lines found as [byte offset, line], decoded as latin-1 to avoid unicode errors
+        with mapFile(file) as mm:
+            lines = findProcessLines(mm, IMSSprocID, start, end)
+    if not lines:
+        logging.warning(f"Process ID {IMSSprocID} not found in {os.path.basename(file)}")
+    logging.info(f"{len(lines)} lines with process ID {IMSSprocID} found in file {os.path.basename(file)}")
+
+    # Only the spans of the lines are kept in the result, the text is read again when the results are written
+    spans = LogSpans()
+    file_ID = fileID(file)
+    for offset, line in lines:
+        spans.append(file_ID, offset, len(line))
+
+    for i, (offset, line) in enumerate(lines):
+        is_start = "Start Rule Set Retrieval spent" in line
+        is_end = "Scan finished for" in line
+        is_ID = msgID in line
+        if not (is_start or is_end or is_ID):
+            continue
+
+        # Convert log timestamp ( ‘YYYY/MM/DD HH:MM:SS GMT-00:00‘) to datetime object, once per line
+        time = parseIMSSTime(line)
+        if is_start:
+            message_starts.append([time, i])
+        if is_end:
+            message_ends.append([time, i])
+        if is_ID:
+            message_IDs.append([time, i])
+    return spans, message_starts, message_IDs, message_ends
+
+class IMSSLogSet(object):
+    '''The rotated log.imss.YYYYMMDD.NNNN files in folder as one ordered log. The first and last timestamp of each
+    file are kept in a small sidecar index (___imss_timerange___.json in indexDir), so boundary searches can go back
+    or forward any number of files and know when to stop without reading them. Within a neighbouring file they seek
+    to byte offsets found in the time samples and the internal ID index (see seekStart() and seekEnd()) instead of
+    reading it whole. Files are named without folder, path() gives their full path.'''
+
+    @profiled("IMSSLogSet")
+    def __init__(self, folder, indexDir, jobs=1):
+        self.folder = folder
+        self.indexDir = indexDir
+        self.jobs = jobs
+        # Loaded on the first seek, most searches never leave the files of their messages
+        self.time_samples = None  # file: [[timestamp, byte offset]...]
+        self.scan_ends = None  # (file, process ID): [[byte offset, internal ID]...]
+        time_ranges = updateIndex(indexDir + IMSSTimeRangeFile, folder, listFiles(folder, "log.imss*"),
+                                  IMSSFileTimeRange, jobs, split=False)
+        self.files = sorted(time_ranges, key=IMSSFileOrder)
+        self.position = {file: i for i, file in enumerate(self.files)}
+        self.time_ranges = {file: [parseIMSSTime(stamp + " ") if stamp else None for stamp in entry["entries"]]
+                            for file, entry in time_ranges.items()}
+
+    def path(self, file):
+        return self.folder + file
+
+    def neighbours(self, file, distance=1):
+        '''Files up to distance files before and after file'''
+        i = self.position.get(file)
+        if i is None:
+            return []
+        return self.files[max(0, i - distance):i] + self.files[i + 1:i + 1 + distance]
+
+    def prevFiles(self, file, since=None):
+        '''Yields the files before file, nearest first, until one that ends before the datetime since'''
+        for prev_file in reversed(self.files[:self.position[file]]):
+            first, last = self.time_ranges[prev_file]
+            if since is not None and last is not None and last < since:
+                return
+            yield prev_file
+
+    def nextFiles(self, file, until=None):
+        '''Yields the files after file, nearest first, until one that starts after the datetime until'''
+        for next_file in self.files[self.position[file] + 1:]:
+            first, last = self.time_ranges[next_file]
+            if until is not None and first is not None and first > until:
+                return
+            yield next_file
+
+    def timeRange(self, file, since=None, until=None):
+        '''Byte range (start, end) of file that holds its lines from the datetime since to until, bisected in the time
+        samples of the files (___imss_timeindex___.json in indexDir, shared with --since/--until)'''
+        if self.time_samples is None:
+            samples = updateIndex(self.indexDir + IMSSTimeIndexFile, self.folder, self.files, sampleIMSSTimes,
+                                  self.jobs)
+            self.time_samples = {name: entry["entries"] for name, entry in samples.items()}
+        since, until = [time.strftime("%Y-%m-%d %H:%M:%S") if time else None for time in (since, until)]
+        return timeWindowRange(self.time_samples.get(file, []), since, until)
+
+    def seekStart(self, file, since):
+        '''Byte offset of file (one before a message's file) from which its lines are from the datetime since on. A
+        scan that took less than maxScanTime started after it.'''
+        return self.timeRange(file, since=since)[0]
+
+    def seekEnd(self, file, IMSSprocID, until):
+        '''Byte offset of file (one after a message's file) up to which its lines are until the datetime until, or up
+        to its first "Scan finished for" line of IMSSprocID when the saved internal ID index is up to date for the file.
+        None for the end of the file.'''
+        if self.scan_ends is None:
+            index = loadIndex(self.indexDir + IMSSInternalIDIndexFile)
+            self.scan_ends = scanEnds({name: entry for name, entry in index.items() if name in self.position and
+                                       entry["fingerprint"] == fileFingerprint(self.path(name))})
+        ends = [self.timeRange(file, until=until)[1]]
+        scan_ends = self.scan_ends.get((file, IMSSprocID))
+        if scan_ends:
+            # Up to and including the line of the scan end
+            ends.append(scan_ends[0][0] + 1)
+        return min([end for end in ends if end is not None], default=None)
+
+class IMSSProcessLogs(object):
+    '''Drop-in for getProcessLogsInFile() when extracting many messages: each part of a log.imss file is read at most
+    once, keeping the lines of every process ID that any of the messages (or their neighbouring files) needs. Files
+    further away, which only scans spanning several rotations reach, are read for the process IDs of all the messages.
+    The byte range of a file read so far is kept with its lines, so a request for another range of the file only reads
+    the bytes not read yet: the files of the messages are read whole, the neighbouring ones only as far as
+    getIMSSLogs() seeks into them.'''
+
+    def __init__(self, messages, logSet):
+        # A message's scan can start in the previous file or end in the next one, so ask for its process ID there too
+        self.wanted = {}  # log.imss path: {process IDs}
+        for message in messages:
+            for file in [message.IMSS_log_file] + logSet.neighbours(message.IMSS_log_file):
+                self.wanted.setdefault(logSet.path(file), set()).add(message.IMSSprocID)
+        self.procIDs = {message.IMSSprocID for message in messages}
+        self.files = {}  # log.imss path: [start, end, {process ID: lines}] of the byte range read so far
+
+    @profiled("getIMSSLogs (read process logs)")
+    def readRange(self, file, IMSSprocIDs, start, end):
+        '''Returns {process ID: lines} of the lines of IMSSprocIDs starting in the byte range [start, end) of file'''
+        proc_lines = {IMSSprocID: [] for IMSSprocID in IMSSprocIDs}
+        if start >= end:
+            return proc_lines
+        logging.info(f"Reading process logs for {len(proc_lines)} process ID(s) from {os.path.basename(file)}, "
+                     f"bytes {start} to {end}")
+        if len(proc_lines) > maxProcessIDSearches:
+            # Go through the lines once and pick out the wanted ones by their process ID field
+            wanted = {IMSSprocID.encode("latin-1"): lines for IMSSprocID, lines in proc_lines.items()}
+            for offset, line in readLines(file, start, end):
+                fields = line.split(None, 4)
+                if len(fields) > 3 and fields[3] in wanted:
+                    wanted[fields[3]].append([offset, line.decode("latin-1")])
+            return proc_lines
+        # Map the file once, then find the lines of each process ID in it
+        with mapFile(file) as mm:
+            for IMSSprocID, lines in proc_lines.items():
+                lines += findProcessLines(mm, IMSSprocID, start, end)
+        return proc_lines
+
+    def __call__(self, file, IMSSprocID, msgID, start=0, end=None):
+        size = os.path.getsize(file)
+        end = size if end is None else min(end, size)
+        if file not in self.files:
+            self.files[file] = [start, start, {IMSSprocID: [] for IMSSprocID in self.wanted.get(file, self.procIDs)}]
+        read_start, read_end, proc_lines = self.files[file]
+        if IMSSprocID not in proc_lines:
+            # Process ID was not requested up front, read the part of the file read so far for it
+            proc_lines.update(self.readRange(file, [IMSSprocID], read_start, read_end))
+        # Extend the range read so far to [start, end), it stays one range so the lines stay in file order
+        if start < read_start:
+            for ID, lines in self.readRange(file, proc_lines, start, read_start).items():
+                proc_lines[ID][:0] = lines
+        if end > read_end:
+            for ID, lines in self.readRange(file, proc_lines, read_end, end).items():
+                proc_lines[ID] += lines
+        self.files[file] = [min(start, read_start), max(end, read_end), proc_lines]
+        lines = proc_lines[IMSSprocID]
+        lines = lines[bisect.bisect_left(lines, [start]):bisect.bisect_left(lines, [end])]
+        return getProcessLogsInFile(file, IMSSprocID, msgID, lines=lines)
+
+@profiled("getIMSSLogs")
+def getIMSSLogs(message, logSet, processLogs=getProcessLogsInFile):
+    '''Returns all the related process lines in a file for a given external message ID and process ID.
+    processLogs reads the process lines from a file, see getProcessLogsInFile() and IMSSProcessLogs.
+    If the scan started or ended in another rotated file, logSet (IMSSLogSet) is used to find it.'''
+    new_result = LogSpans()  # result after extracting relevant time frame from process logs
+
+    # result will contain all relevant process logs in current file
+    result, message_starts, message_IDs, message_ends = processLogs(logSet.path(message.IMSS_log_file),
+                                                                    message.IMSSprocID, message.externalID)
+
+    if result and message_IDs:
+        '''The following logic checks if the message start and end is on the same log file, if not it gets the process
+        logs from the next and previous files and combines them with original log file.
+        Also creates result_start which is every log line from message start to message ID
+        and result_end which is every log line from message ID to message end.
+        Creating start and end result lists was necessary because the logic uses line numbers from
+        getProcessLogsInFile() and trimming the original result to only start at relevant start will
+        modify the log lines before you can trim the end'''
+
+        logging.debug(f"message starts: {message_starts}")
+        logging.debug(f"message IDs: {message_IDs}")
+        logging.debug(f"message ends: {message_ends}")
+
+        # If there is no message start found or the first start occurs later than the first message ID
+        if not message_starts or message_starts[0][0] > message_IDs[0][0]:
+            # Trim result from beginning of file to message ID
+            result_start = result[:message_IDs[0][1]]
+
+            # Go back through the rotated files until one has a message start for the process ID.
+            # A file without any message start for it is all part of this message's scan.
+            since = message_IDs[0][0] - maxScanTime
+            for prev_IMSS_file in logSet.prevFiles(message.IMSS_log_file, since):
+                logging.debug(f"Check previous file {prev_IMSS_file}")
+                with profiler.stage("getIMSSLogs (neighbour files)"):
+                    # Seek to maxScanTime before the message ID, the start of a longer scan is in the rest of the file
+                    start = logSet.seekStart(prev_IMSS_file, since)
+                    prev_result, prev_message_starts, prev_message_IDs, prev_message_ends = \
+                        processLogs(logSet.path(prev_IMSS_file), message.IMSSprocID, message.externalID, start)
+                    if not prev_message_starts and start:
+                        prev_result, prev_message_starts, prev_message_IDs, prev_message_ends = \
+                            processLogs(logSet.path(prev_IMSS_file), message.IMSSprocID, message.externalID)
+                if prev_message_starts:
+                    message.start_scan_time = prev_message_starts[-1][0]
+                    # get all process ID logs from previous file from last message start until end
+                    result_start = prev_result[prev_message_starts[-1][1]:] + result_start
+                    break
+                result_start = prev_result + result_start
+            else:
+                raise IndexError(f"Message start not found in log files before {message.IMSS_log_file}")
+
+        else:
+            # print(list(zip(*message_starts))[0])  # returns a list of the datetimes of all the message_starts
+            # Find the insertion point where the message ID timestamp would be inserted after next message start time stamp.
+            i = bisect.bisect(list(zip(*message_starts))[1], message_IDs[0][1])
+            # changed i to i-1 because bisect returns the insertion point for message_ID which is in next position
+            message.start_scan_time = message_starts[i-1][0]
+            result_start = result[message_starts[i-1][1]:message_IDs[0][1]]
+
+        # If there is no message end found or the last message end occurs before the last message ID
+        if not message_ends or message_ends[-1][0] < message_IDs[-1][0]:
+            # Trim result from last message ID to end of file
+            result_end = result[message_IDs[-1][1]:]
+
+            # Go forward through the rotated files until one has a message end for the process ID
+            until = message_IDs[-1][0] + maxScanTime
+            for next_IMSS_file in logSet.nextFiles(message.IMSS_log_file, until):
+                logging.debug(f"Check next file {next_IMSS_file}")
+                with profiler.stage("getIMSSLogs (neighbour files)"):
+                    # Only read up to the scan end, or maxScanTime after the message ID when the index has none
+                    end = logSet.seekEnd(next_IMSS_file, message.IMSSprocID, until)
+                    next_result, next_message_starts, next_message_IDs, next_message_ends = \
+                        processLogs(logSet.path(next_IMSS_file), message.IMSSprocID, message.externalID, 0, end)
+                    if not next_message_ends and end is not None:
+                        next_result, next_message_starts, next_message_IDs, next_message_ends = \
+                            processLogs(logSet.path(next_IMSS_file), message.IMSSprocID, message.externalID)
+                if next_message_ends:
+                    message.end_scan_time = next_message_ends[0][0]
+                    # get all process ID logs from next file up to and including the line of the first message end.
+                    result_end = result_end + next_result[:next_message_ends[0][1] + 1]
+                    break
+                result_end = result_end + next_result
+            else:
+                raise IndexError(f"Message end not found in log files after {message.IMSS_log_file}")
+        else:
+            # print(list(zip(*message_ends))[0]) # returns a list of the datetimes of all the message_ends
+            # Find the insertion point where the message ID timestamp would be inserted before next message end time stamp.
+            #TODO: test this
+            j = bisect.bisect_left(list(zip(*message_ends))[1], message_IDs[0][1])
+            message.end_scan_time = message_ends[j][0]
+            result_end = result[message_IDs[0][1]:message_ends[j][1] + 1]
+
+        new_result = result_start + result_end
+
+        logging.info(f"Message scan start time: {message.start_scan_time}")
+        logging.info(f"Message scan end time: {message.end_scan_time}")
+
+    else:
+        logging.warning(f"No lines with process ID {message.IMSSprocID} found in file {message.IMSS_log_file}")
+
+    return new_result
+
+def getIMSSLogsBatch(messages, logSet, processLogs=None, writer=None):
+    '''Same result as calling getIMSSLogs() for each message, but reads each log.imss file at most once in total
+    instead of once per message. Pass processLogs to share the files read with other batches of messages, and
+    a ResultWriter to write each message as soon as its logs are extracted.'''
+    if processLogs is None:
+        processLogs = IMSSProcessLogs(messages, logSet)
+    for message in messages:
+        try:
+            message.IMSSLogs = getIMSSLogs(message, logSet, processLogs)
+        except (IndexError, OSError) as e:
+            # e.g. scan start or end is in a rotated file that is not in the CDT
+            logging.error(f"Could not get IMSS logs for message #{message.id} with external ID "
+                          f"{message.externalID}: {e!r}")
+            message.IMSSLogs = LogSpans()
+        if writer:
+            writer.writeIMSSMessage(message)
+    return messages
+
+def scanEnds(index):
+    '''{(file, process ID): [[byte offset, internal ID]...]} of the "Scan finished for" lines in the internal ID index
+    from Searcher.getIMSSInternalIDIndex(), in file order'''
+    ends = {}
+    for file, file_index in index.items():
+        for internalID, offset, IMSSprocID, timestamp in file_index["entries"]:
+            ends.setdefault((file, IMSSprocID), []).append([offset, internalID])
+    return ends
+
+def getInternalIDs(message, ends, logSet):
+    '''Returns the internal IDs of a message: the one of the first "Scan finished for" line of its process ID after its
+    Message-ID line, in the same log.imss file or the next ones (up to maxScanTime after the end of its file), looked
+    up in scanEnds() of the internal ID index instead of read from the log lines'''
+    file_ends = ends.get((message.IMSS_log_file, message.IMSSprocID), [])
+    i = bisect.bisect(file_ends, [message.IMSS_log_offset, ""])
+    if i < len(file_ends):
+        return [file_ends[i][1]]
+    if message.IMSS_log_file in logSet.position:
+        last = logSet.time_ranges[message.IMSS_log_file][1]
+        for next_file in logSet.nextFiles(message.IMSS_log_file, last + maxScanTime if last else None):
+            next_ends = ends.get((next_file, message.IMSSprocID))
+            if next_ends:
+                return [next_ends[0][1]]
+    logging.warning(f"Internal message ID of message #{message.id} not found in log.imss")
+    return []
+
+class MultiMatcher(object):
+    '''Aho-Corasick automaton for finding which of many literal patterns occur in a text, case-insensitively,
+    in one pass over the text however many patterns there are'''
+
+    def __init__(self, patterns):
+        self.goto = [{}]  # node: {character: next node}
+        self.fail = [0]  # node: node for the longest suffix that is also in the automaton
+        self.out = [[]]  # node: indexes of the patterns that end at node
+        for i, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern.lower():
+                if ch not in self.goto[node]:
+                    self.goto[node][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = self.goto[node][ch]
+            self.out[node].append(i)
+
+        # Breadth first, so the fail node of a node is always done before the node itself
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_node] = self.goto[fail].get(ch, 0)
+                self.out[next_node] = self.out[next_node] + self.out[self.fail[next_node]]
+
+    def search(self, text):
+        '''Returns the set of indexes of the patterns found in text'''
+        found = set()
+        node = 0
+        for ch in text.lower():
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.out[node]:
+                found.update(self.out[node])
+        return found
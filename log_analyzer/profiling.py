@@ -0,0 +1,108 @@
+# Stage timers and counters of the log search, reported by --profile
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import functools
+import collections
+from contextlib import contextmanager
+
+from .settings import ProfileFile, CProfileFile
+
+class Profiler(object):
+    '''Stage timers and counters for --profile. Time spent in a stage that runs inside another one is only counted
+    for the inner stage, so the stage times add up to the time of the whole search. Each thread has its own stack of
+    running stages, so searches running on several threads at once add up their times without mixing up stages.'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name: [seconds, calls]
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+        self.threads = threading.local()  # .running: [name, time the stage was entered or last resumed], innermost last
+
+    def running(self):
+        '''Stages running on the current thread'''
+        if not hasattr(self.threads, "running"):
+            self.threads.running = []
+        return self.threads.running
+
+    def addTime(self, name, seconds, calls=0):
+        with self.lock:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    @contextmanager
+    def stage(self, name):
+        running = self.running()
+        now = time.perf_counter()
+        if running:
+            outer, resumed = running[-1]
+            self.addTime(outer, now - resumed)
+        running.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            name, resumed = running.pop()
+            self.addTime(name, now - resumed, 1)
+            if running:
+                running[-1][1] = now
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def addCounts(self, counters):
+        '''Adds the counters of a worker process (see indexes.profiledScan())'''
+        with self.lock:
+            self.counters.update(counters)
+
+    def takeCounts(self):
+        '''Returns the counters and starts them again from zero'''
+        with self.lock:
+            counters, self.counters = dict(self.counters), collections.Counter()
+        return counters
+
+    def report(self):
+        with self.lock:
+            return {
+                "command": sys.argv,
+                "total_seconds": round(time.perf_counter() - self.started, 3),
+                "stages": {name: {"seconds": round(seconds, 3), "calls": calls}
+                           for name, (seconds, calls) in sorted(self.stages.items(), key=lambda item: -item[1][0])},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+profiler = Profiler()
+
+def profiled(name):
+    '''Decorator that times every call of a function as the --profile stage name'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def writeProfile(outDir, cprofile=None):
+    '''Writes the --profile report to outDir, with the slowest functions if cprofile (cProfile.Profile) ran'''
+    report = profiler.report()
+    os.makedirs(outDir, exist_ok=True)
+    if cprofile is not None:
+        import pstats  # only needed with --profile cprofile, and slow to import
+        cprofile.disable()
+        cprofile.dump_stats(outDir + CProfileFile)
+        stats = pstats.Stats(cprofile).stats
+        report["functions"] = [{"function": f"{file}:{line}({function})", "calls": calls,
+                                "seconds": round(own_time, 3), "cumulative_seconds": round(total_time, 3)}
+                               for (file, line, function), (primitive_calls, calls, own_time, total_time, callers)
+                               in sorted(stats.items(), key=lambda item: -item[1][2])[:30]]
+    with open(outDir + ProfileFile, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Profile written to {outDir + ProfileFile}")
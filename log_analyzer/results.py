@@ -0,0 +1,226 @@
+# Writing the search results, and keeping them in the result cache
+
+import os
+import json
+import time
+import heapq
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from .profiling import profiled
+from .logfiles import LogSpans, log_files, IMSSLocalTime, fileLastWritten, maillogTime
+from .settings import ResultCacheDir, ResultCacheFile, resultCacheSize
+
+# Files a ResultWriter writes, which are what the result cache keeps of a search
+resultFiles = ["___log.imss___.txt", "___message___.ndjson", "___maillogs___.txt", "___maillog_messages___.ndjson",
+               "___merged_messages___.json", "___timeline___.txt"]
+
+def jsonValue(value):
+    '''json.dumps() default for the message attributes that are not JSON types'''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def spanRuns(spans):
+    '''Splits LogSpans into the runs of consecutive lines from the same log file (text lines are left out). Each run
+    is in log order, but runs from rotated files or other queue IDs are not in order with each other.'''
+    start = 0
+    for i in range(1, len(spans) + 1):
+        if i == len(spans) or spans.file_IDs[i] != spans.file_IDs[start]:
+            if spans.file_IDs[start] != 0:
+                yield spans[start:i]
+            start = i
+
+def timedLines(run, family, lineTime):
+    '''Yields (time, family, file ID, byte offset, line) for a run of lines from spanRuns(), read as it goes. Lines
+    without a timestamp (lineTime(line) is None) get the time of the line before them.'''
+    time = ""
+    for file_ID, offset, line in zip(run.file_IDs, run.offsets, run):
+        time = lineTime(line) or time
+        yield time, family, file_ID, offset, line
+
+def messageTimeline(IMSS_messages, maillog_messages):
+    '''Yields (time, family, line) for the log.imss lines of IMSS_messages and the maillog lines of maillog_messages
+    in time order, as "YYYY-MM-DD HH:MM:SS" local time for both log families. The lines are merged with
+    heapq.merge() from one stream per run of lines (see spanRuns()), which are already in order, so the lines are
+    read one at a time instead of loaded and sorted. A line in the logs of more than one queue ID (the
+    "queued as" hand-off) is only listed once.
+    Maillog timestamps have no year. It is taken from the first log.imss line when there is one, so both families
+    line up even if the maillog mtime is off, and from the maillog file otherwise (see maillogTime()).'''
+    streams = []
+    scanned = None
+    for message in IMSS_messages:
+        streams += [timedLines(run, "IMSS", IMSSLocalTime) for run in spanRuns(message.IMSSLogs or LogSpans())]
+        if scanned is None and message.IMSSLogs:
+            time = IMSSLocalTime(message.IMSSLogs[0])
+            scanned = datetime.fromisoformat(time) if time else None
+    for message in maillog_messages:
+        for run in spanRuns(message.maillogs or LogSpans()):
+            # Up to a month after the scan still counts as the same year, for mail delivered over New Year
+            lastWritten = scanned + timedelta(days=31) if scanned else fileLastWritten(log_files[run.file_IDs[0]])
+            streams.append(timedLines(run, "maillog", lambda line, lastWritten=lastWritten: maillogTime(line, lastWritten)))
+    seen = set()
+    for time, family, file_ID, offset, line in heapq.merge(*streams, key=lambda event: event[0]):
+        if (file_ID, offset) not in seen:
+            seen.add((file_ID, offset))
+            yield time, family, line
+
+class ResultWriter(object):
+    '''Writes the search results to outDir while the search is running. Each message is written as soon as its
+    logs are extracted: its lines go to the ___log.imss___.txt / ___maillogs___.txt text files and its attributes to
+    one NDJSON record (one JSON object per line) in ___message___.ndjson / ___maillog_messages___.ndjson.
+    Files are flushed after each message so other tools can follow them. Once all messages are done, the IMSS and
+    maillog lines of each external ID are written interleaved in time order to ___timeline___.txt.'''
+
+    def __init__(self, outDir):
+        os.makedirs(outDir, exist_ok=True)
+        self.outDir = outDir
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+    def file(self, name):
+        if name not in self.files:
+            self.files[name] = open(self.outDir + name, "w", encoding="latin-1" if name.endswith(".txt") else "utf-8")
+        return self.files[name]
+
+    @profiled("output")
+    def writeMessage(self, message, logs_attribute, text_file, ndjson_file):
+        # Read the lines back from the log files once, for both the text file and the NDJSON record
+        record = message.toDict()
+        if record[logs_attribute]:
+            fo = self.file(text_file)
+            fo.write(f"Message #{message.id}\n")
+            fo.writelines(record[logs_attribute])
+            fo.flush()
+        f = self.file(ndjson_file)
+        f.write(json.dumps(record, default=jsonValue) + "\n")
+        f.flush()
+
+    def writeIMSSMessage(self, message):
+        self.writeMessage(message, "IMSSLogs", "___log.imss___.txt", "___message___.ndjson")
+
+    def writeMaillogMessage(self, message):
+        self.writeMessage(message, "maillogs", "___maillogs___.txt", "___maillog_messages___.ndjson")
+
+    @profiled("output")
+    def writeMergedMessages(self, merged_messages):
+        f = self.file("___merged_messages___.json")
+        for message in merged_messages or []:
+            f.write(f"\n-------- Message #{message.id} --------\n\n")
+            f.writelines(message.maillogs)
+        f.flush()
+
+    @profiled("output")
+    def writeTimelines(self, messages, maillog_messages):
+        '''Writes a timeline (see messageTimeline()) for each external ID, joining the IMSS messages and the maillog
+        messages (all queue IDs of its chain) that have it'''
+        by_externalID = {}  # external ID: ([IMSS messages], [maillog messages]), in the order they were found
+        for message in messages:
+            by_externalID.setdefault(message.externalID, ([], []))[0].append(message)
+        for message in maillog_messages:
+            by_externalID.setdefault(message.externalID, ([], []))[1].append(message)
+        f = self.file("___timeline___.txt")
+        for externalID, (IMSS_messages, found_maillogs) in by_externalID.items():
+            f.write(f"\n-------- {externalID}: {len(IMSS_messages)} IMSS message(s), queue IDs "
+                    f"{', '.join(message.maillogQueueIDs for message in found_maillogs) or 'none'} --------\n\n")
+            for stamp, family, line in messageTimeline(IMSS_messages, found_maillogs):
+                f.write(f"{stamp:19}  {family:7}  {line}")
+        f.flush()
+
+    def close(self, complete=True):
+        # Create the usual files even when nothing was found, but leave the results of the last search alone when
+        # this one failed before writing them
+        if complete:
+            for name in resultFiles:
+                self.file(name)
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+class ResultCache(object):
+    '''Result files of earlier searches of a CDT, in outDir + ResultCacheDir with one folder per query. A query is
+    its normalized message ID and --since/--until; its results are used again as long as the size and mtime of
+    every log file of the CDT are the same as when it was searched. The entries and when each was last used are
+    listed in ResultCacheFile, and the least recently used ones are removed to keep the cache under maxSize bytes.'''
+
+    def __init__(self, outDir, maxSize=resultCacheSize):
+        self.folder = outDir + ResultCacheDir
+        self.maxSize = maxSize
+        try:
+            with open(self.folder + ResultCacheFile, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def query(msgID, since=None, until=None):
+        # Both searches ignore case, so IDs that only differ in case are the same query. Patterns with escapes
+        # are left alone, lower case changes what \S or \W mean.
+        msgID = msgID.strip()
+        if "\\" not in msgID:
+            msgID = msgID.lower()
+        return {"message_id": msgID, "since": since, "until": until}
+
+    @staticmethod
+    def key(query):
+        return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()[:32]
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.folder + ResultCacheFile + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(self.folder + ResultCacheFile + ".tmp", self.folder + ResultCacheFile)
+
+    def remove(self, key):
+        shutil.rmtree(self.folder + key, ignore_errors=True)
+        self.entries.pop(key, None)
+
+    def get(self, query, fingerprints, outDir):
+        '''Copies the cached result files of query to outDir and returns its message counts, or returns None when
+        the query is not cached or was cached for log files that changed since (then the entry is removed)'''
+        key = self.key(query)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry["fingerprints"] != fingerprints or \
+                not all(os.path.isfile(self.folder + key + "/" + name) for name in resultFiles):
+            logging.info("Log files changed since the last search for this query, searching again")
+            self.remove(key)
+            self.save()
+            return None
+        os.makedirs(outDir, exist_ok=True)
+        for name in resultFiles:
+            shutil.copyfile(self.folder + key + "/" + name, outDir + name)
+        entry["last_used"] = time.time()
+        self.save()
+        return entry["counts"]
+
+    def put(self, query, fingerprints, outDir, counts):
+        '''Keeps a copy of the result files of query from outDir, then removes least recently used entries until
+        the cache fits in maxSize'''
+        key = self.key(query)
+        self.remove(key)
+        size = sum(os.path.getsize(outDir + name) for name in resultFiles)
+        if size > self.maxSize:
+            logging.info(f"Results are bigger than the result cache ({size} bytes), not caching them")
+        else:
+            os.makedirs(self.folder + key, exist_ok=True)
+            for name in resultFiles:
+                shutil.copyfile(outDir + name, self.folder + key + "/" + name)
+            self.entries[key] = {"query": query, "fingerprints": fingerprints, "counts": counts, "size": size,
+                                 "last_used": time.time()}
+        total = sum(entry["size"] for entry in self.entries.values())
+        for old_key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.maxSize:
+                break
+            logging.debug(f"Removing cached results of {self.entries[old_key]['query']}")
+            total -= self.entries[old_key]["size"]
+            self.remove(old_key)
+        self.save()
@@ -0,0 +1,429 @@
+# Searching a CDT: extracting its logs, finding the messages for a message ID and getting all their log lines
+
+import os
+import re
+import copy
+import shutil
+import contextlib
+import logging
+from datetime import datetime, timedelta
+
+from .profiling import profiler, profiled
+from .logfiles import LogSpans, fileID, fileFingerprint, fileLastWritten, listFiles, pathLock, IMSSLocalTime, \
+    maillogTime
+from .indexes import updateIndex, scanFiles, searchFile, indexIMSSFile, indexMaillogFile, indexIMSSInternalIDFile, \
+    indexPolevtFile, sampleIMSSTimes, sampleMaillogTimes, timeWindowRange
+from .messages import IMSSLogSet, IMSSProcessLogs, MultiMatcher, newIMSSMessage, newMaillogMessage, \
+    maillogExternalID, getMaillogs, combineMaillogMessages, getIMSSLogsBatch, scanEnds, getInternalIDs
+from .results import ResultWriter, ResultCache
+from .settings import IMSSLogDir, maillogDir, CDTpassword, OutputFolder, IMSSIndexFile, MaillogIndexFile, \
+    IMSSInternalIDIndexFile, PolevtIndexFile, IMSSTimeIndexFile, MaillogTimeIndexFile, maillogWindowMargin
+
+def CDTmemberPath(name):
+    '''Returns the path inside the CDT folder to extract a CDT zip member to, or None if the log search does not need
+    it. Only log.imss and polevt files from Event3 and maillog files from Event5 are needed.'''
+    path = name.replace("\\", "/")
+    file = path.rsplit("/", 1)[-1]
+    # Folder names are not always capitalized the same way (LogFile vs Logfile), so compare them in lower case
+    if "imsva/logfile/event3/" in path.lower() and file.startswith(("log.imss", "polevt")):
+        return IMSSLogDir + file
+    if "imsva/logfile/event5/" in path.lower() and file.startswith("maillog"):
+        return os.path.join(maillogDir, file)
+    return None
+
+def find7zip():
+    for path in (shutil.which("7z"), shutil.which("7za"), "C:/Program Files/7-Zip/7z.exe"):
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+def extractCDT(zipPath, folder):
+    '''Extracts the log.imss and maillog files from a CDT zip into folder (full paths), skipping everything else in
+    the archive. Members are streamed straight out of the zip with zipfile, so no 7-Zip is needed, and members that
+    were already extracted with the same size are not extracted again (the folder works as a cache). Nothing depends
+    on the working directory, so CDTs can be extracted on several threads at once.
+    7-Zip is only used for archives zipfile can't decrypt (AES) or decompress.'''
+    import zipfile  # only needed when there is a CDT zip to extract, and slow to import
+    name = os.path.basename(zipPath)
+    with zipfile.ZipFile(zipPath) as z:
+        members = [(member, CDTmemberPath(member.filename)) for member in z.infolist() if not member.is_dir()]
+        members = [(member, os.path.join(folder, path)) for member, path in members if path]
+        logging.info(f"{len(members)} log file(s) needed from {name}")
+        for member, path in members:
+            if os.path.isfile(path) and os.path.getsize(path) == member.file_size:
+                logging.debug(f"{path} already extracted, take no action")
+                continue
+            logging.info(f"Extracting {member.filename} to {path}...")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                with z.open(member, pwd=CDTpassword.encode()) as src, open(path + ".part", "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            except NotImplementedError as e:
+                # zipfile only supports ZipCrypto passwords and the common compression methods. It usually says so in
+                # z.open(), before the .part file is created.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path + ".part")
+                logging.info(f"zipfile could not extract {member.filename} ({e}), trying 7-Zip")
+                unzip_CDT_7zip(zipPath, folder)
+                return
+            # Keep the time the log was last written, maillog timestamps get their year from it
+            mtime = datetime(*member.date_time).timestamp()
+            os.utime(path + ".part", (mtime, mtime))
+            os.replace(path + ".part", path)
+
+def list7zip(listing):
+    '''Returns [(member name, size, modified datetime or None)] of the files in the technical listing (7z l -slt) of
+    an archive'''
+    members = []
+    # Properties of the archive itself come before the ---------- line, then one block per member
+    for block in listing.partition("\n----------\n")[2].split("\n\n"):
+        fields = dict(line.split(" = ", 1) for line in block.splitlines() if " = " in line)
+        if "Path" not in fields or fields.get("Folder") == "+" or "D" in fields.get("Attributes", "").split("_")[0]:
+            continue
+        try:
+            modified = datetime.fromisoformat(fields.get("Modified", "")[:19])
+        except ValueError:
+            modified = None
+        members.append((fields["Path"], int(fields.get("Size") or 0), modified))
+    return members
+
+def unzip_CDT_7zip(zipPath, folder):
+    '''Extracts the log.imss, polevt and maillog files from the CDT zipPath into folder with 7-Zip. The archive is
+    listed first and its members picked with CDTmemberPath(), like extractCDT() does, so folder names match whatever
+    their capitalization and the files land in the same paths.'''
+    import subprocess
+    sevenZip = find7zip()
+    if sevenZip is None:
+        raise RuntimeError(f"7-Zip is needed to extract {zipPath} but was not found")
+    # in CMD prompt: "C:/Program Files/7-Zip/7z.exe" l -slt /Users/joelg/Downloads/test/CDT-20211028-121205.zip -p"trend"
+    listing = subprocess.run([sevenZip, "l", "-slt", "-sccUTF-8", f"-p{CDTpassword}", zipPath],
+                             stdout=subprocess.PIPE, check=True).stdout.decode("utf-8", "replace")
+    members = [(name, size, modified, CDTmemberPath(name)) for name, size, modified in
+               list7zip(listing.replace("\r\n", "\n"))]
+    members = [(name, size, modified, os.path.join(folder, path)) for name, size, modified, path in members if path]
+    logging.info(f"{len(members)} log file(s) needed from {os.path.basename(zipPath)}")
+    for name, size, modified, path in members:
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            logging.debug(f"{path} already extracted, take no action")
+            continue
+        logging.info(f"Extracting {name} to {path} with 7-Zip...")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # -so writes the member to stdout, so it goes straight to its path whatever its folder is called in the zip
+        with open(path + ".part", "wb") as dst:
+            process = subprocess.run([sevenZip, "e", "-so", f"-p{CDTpassword}", zipPath, name], stdout=dst)
+        if process.returncode != 0:
+            os.remove(path + ".part")
+            raise RuntimeError(f"7-Zip could not extract {name} from {zipPath} (exit code {process.returncode})")
+        if modified is not None:
+            # Keep the time the log was last written, maillog timestamps get their year from it
+            os.utime(path + ".part", (modified.timestamp(), modified.timestamp()))
+        os.replace(path + ".part", path)
+
+def checkMessageID(msgID):
+    '''Raises ValueError for an empty message ID, and re.error if it is not a valid regex'''
+    if msgID == "":
+        raise ValueError("Please enter message ID and try again")
+    re.compile(msgID)
+    re.compile(rf'message-id=<\S*{msgID}\S*')
+
+class Searcher(object):
+    '''Searches one CDT: the CDT zip CDTname in workingDir, or its unzipped folder next to it. The indexes, results and
+    search log go to outputDir, in the CDT folder. Log files are scanned on jobs processes (see scanFiles()), and only
+    the messages logged from since to until ("YYYY-MM-DD HH:MM:SS" local time, see windowTime()) are found.
+
+    A Searcher only holds paths and settings, which are not changed once it is made, and every search keeps its
+    results to itself, so searches of the same or different CDTs can run at once on several threads. Nothing uses
+    the working directory of the process. Indexes loaded by one search are kept in memory for the others.'''
+
+    def __init__(self, workingDir, CDTname, jobs=1, since=None, until=None):
+        self.workingDir = os.path.join(os.path.abspath(workingDir), "")
+        self.CDTname = CDTname
+        self.CDTfolder = CDTname[:-4] + "/"
+        self.outputDir = self.workingDir + self.CDTfolder + OutputFolder
+        self.IMSSFolder = self.workingDir + self.CDTfolder + IMSSLogDir
+        self.maillogFolder = os.path.join(self.workingDir + self.CDTfolder + maillogDir, "")
+        self.jobs = jobs
+        self.since = since
+        self.until = until
+
+    def window(self, since=None, until=None):
+        '''Returns a copy of the Searcher that only finds the messages logged from since to until'''
+        searcher = copy.copy(self)
+        searcher.since, searcher.until = since, until
+        return searcher
+
+    @profiled("unzip_CDT")
+    def unzip_CDT(self):
+        '''Extracts the log files the search needs from the CDT zip into the CDT folder, see extractCDT(). Without
+        the zip, the unzipped CDT folder is used as it is.'''
+        if not os.path.isfile(self.workingDir + self.CDTname):
+            if os.path.isdir(self.workingDir + self.CDTfolder):
+                logging.info(f"{datetime.now()} CDT file {self.CDTname} not found, using unzipped folder "
+                             f"{self.workingDir + self.CDTfolder}")
+                return
+            raise FileNotFoundError(f"CDT file {self.workingDir + self.CDTname} not found")
+        extractCDT(self.workingDir + self.CDTname, self.workingDir + self.CDTfolder)
+
+    def inTimeWindow(self, time):
+        '''True if the "YYYY-MM-DD HH:MM:SS" time is from since to until, always True without them'''
+        if not (self.since or self.until):
+            return True
+        return time is not None and (not self.since or time >= self.since) \
+            and (not self.until or time <= self.until)
+
+    @profiled("timeWindowRanges")
+    def timeWindowRanges(self, name, folder, files, sampleFile, margin=timedelta(0)):
+        '''Returns {file: (start, end)} byte ranges of the files in folder that hold the lines from since to until,
+        using the time sample index name kept up to date with sampleFile(file), or None without since/until'''
+        if not (self.since or self.until):
+            return None
+        samples = updateIndex(self.outputDir + name, folder, files, sampleFile, self.jobs)
+        ranges = {file: timeWindowRange(entry["entries"], self.since, self.until, margin)
+                  for file, entry in samples.items()}
+        for file, (start, end) in ranges.items():
+            logging.debug(f"Time window of {file}: bytes {start} to {end if end is not None else 'end'}")
+        return ranges
+
+    @profiled("getIMSSIndex")
+    def getIMSSIndex(self):
+        '''Returns the Message-ID index of the log.imss files of the CDT, see indexIMSSFile().
+        With since/until the entries are not filtered by time, but files not indexed yet are only read around the
+        window, see timeWindowRanges().'''
+        files = listFiles(self.IMSSFolder, "log.imss*")
+        ranges = self.timeWindowRanges(IMSSTimeIndexFile, self.IMSSFolder, files, sampleIMSSTimes)
+        return updateIndex(self.outputDir + IMSSIndexFile, self.IMSSFolder, files, indexIMSSFile, self.jobs,
+                           ranges=ranges)
+
+    @profiled("getIMSSInternalIDIndex")
+    def getIMSSInternalIDIndex(self):
+        '''Returns the internal ID index of the log.imss files of the CDT, see indexIMSSInternalIDFile()'''
+        files = listFiles(self.IMSSFolder, "log.imss*")
+        ranges = self.timeWindowRanges(IMSSTimeIndexFile, self.IMSSFolder, files, sampleIMSSTimes)
+        return updateIndex(self.outputDir + IMSSInternalIDIndexFile, self.IMSSFolder, files, indexIMSSInternalIDFile,
+                           self.jobs, ranges=ranges)
+
+    @profiled("getPolevtIndex")
+    def getPolevtIndex(self):
+        '''Returns the internal ID index of the polevt files of the CDT, see indexPolevtFile()'''
+        return updateIndex(self.outputDir + PolevtIndexFile, self.IMSSFolder, listFiles(self.IMSSFolder, "polevt*"),
+                           indexPolevtFile, self.jobs)
+
+    @profiled("getMaillogIndex")
+    def getMaillogIndex(self):
+        '''Returns the queue ID index of the maillog files of the CDT, see indexMaillogFile().
+        With since/until, files not indexed yet are only read from maillogWindowMargin before the window to
+        maillogWindowMargin after it.'''
+        files = listFiles(self.maillogFolder, "maillog*")
+        ranges = self.timeWindowRanges(MaillogTimeIndexFile, self.maillogFolder, files, sampleMaillogTimes,
+                                       maillogWindowMargin)
+        return updateIndex(self.outputDir + MaillogIndexFile, self.maillogFolder, files, indexMaillogFile, self.jobs,
+                           ranges=ranges)
+
+    def logSet(self):
+        '''The log.imss files of the CDT as an IMSSLogSet'''
+        return IMSSLogSet(self.IMSSFolder, self.outputDir, self.jobs)
+
+    @profiled("findMessagesinIMSSlogs")
+    def findMessagesinIMSSlogs(self, msgID):
+        '''Returns a Message for every Message-ID line of the log.imss files whose external ID matches msgID (a regex,
+        ignoring case), found in the saved Message-ID index instead of reading every line'''
+        checkMessageID(msgID)
+        index = self.getIMSSIndex()
+        messages = []
+
+        # Same match as searching each line for '>>> Message-ID : <\S*{msgID}\S*', but against the indexed IDs
+        exp = re.compile(msgID, re.IGNORECASE)
+        for file, file_index in index.items():
+            hits = [entry for entry in file_index["entries"]
+                    if exp.search(entry[0]) and self.inTimeWindow(IMSSLocalTime(entry[3] + " "))]
+            profiler.count("regex_evaluations", len(file_index["entries"]))
+            profiler.count("regex_hits", len(hits))
+            for entry in hits:
+                messages.append(newIMSSMessage(len(messages) + 1, file, entry))
+        if not messages:
+            logging.warning("Message ID not found in IMSS logs!")
+        return messages
+
+    @profiled("findMessagesinMaillogs")
+    def findMessagesinMaillogs(self, msgID, echo=False):
+        '''Returns a Message for every "message-id=<...>" line of the maillog files whose external ID matches msgID.
+        With echo the lines are printed as well.'''
+        # Sorted so messages are numbered the same however many jobs scan the files
+        maillog_files = listFiles(self.maillogFolder, "maillog*")
+        maillog_messages = []
+        exp = re.compile(rf'message-id=<\S*{msgID}\S*', re.IGNORECASE)
+        # With since/until only the part of each file around the window is read
+        ranges = self.timeWindowRanges(MaillogTimeIndexFile, self.maillogFolder, maillog_files, sampleMaillogTimes)
+        # Postfix cleanup always logs the external ID as lowercase "message-id=<", so only those lines need the regex
+        for file, lines in scanFiles(searchFile, self.maillogFolder, maillog_files, exp.pattern, exp.flags,
+                                     b"message-id=<", jobs=self.jobs, ranges=ranges).items():
+            lastWritten = fileLastWritten(self.maillogFolder + file)
+            for offset, line in lines:
+                if not self.inTimeWindow(maillogTime(line, lastWritten)):
+                    continue
+                if echo:
+                    print(line)
+                # Get Postfix queue IDs from maillog lines where external ID is found
+                maillog_messages.append(newMaillogMessage(len(maillog_messages) + 1, file, line))
+        if not maillog_messages:
+            logging.warning("Message ID not found in Postfix maillogs!")
+        return maillog_messages
+
+    @profiled("correlateMessages")
+    def correlateMessages(self, messages, maillog_messages, merged_messages, logSet):
+        '''Joins what the logs know about each IMSS message by hash lookups in the indexes: its internal IDs (from the
+        internal ID index), its policy events (polevt lines of those internal IDs) and the Postfix queue IDs of the
+        maillog messages with the same external ID (the whole queue chain when they were merged)'''
+        if not messages:
+            return messages
+        ends = scanEnds(self.getIMSSInternalIDIndex())
+        polevt_index = self.getPolevtIndex()
+
+        queue_IDs = {}  # external ID: queue IDs
+        for message in maillog_messages:
+            queue_IDs.setdefault(message.externalID, []).append(message.maillogQueueIDs)
+        for merged in merged_messages or []:
+            queue_IDs[merged.externalID] = list(dict.fromkeys(queue_IDs.get(merged.externalID, []) +
+                                                              merged.maillogQueueIDs))
+
+        for message in messages:
+            message.internalIDs = getInternalIDs(message, ends, logSet)
+            message.relatedQueueIDs = queue_IDs.get(message.externalID, [])
+            message.policyEvents = LogSpans()
+            for file, file_index in polevt_index.items():
+                file_ID = fileID(self.IMSSFolder + file)
+                for internalID in message.internalIDs:
+                    for offset in file_index["entries"].get(internalID.upper(), []):
+                        message.policyEvents.append(file_ID, offset)
+            logging.info(f"Message #{message.id}: internal IDs {message.internalIDs}, {len(message.policyEvents)} "
+                         f"policy event(s), queue IDs {message.relatedQueueIDs}")
+        return messages
+
+    def prepare(self):
+        '''Extracts the CDT logs if needed and loads (or builds) its indexes'''
+        self.unzip_CDT()
+        self.getIMSSIndex()
+        self.getMaillogIndex()
+        self.getIMSSInternalIDIndex()
+        self.getPolevtIndex()
+        self.logSet()
+
+    def search(self, msgID, writer=None, echo=False):
+        '''Finds the messages for msgID in the IMSS logs and maillogs and gets all their logs, like main.py does.
+        Returns (IMSS messages, maillog messages, merged maillog messages). A ResultWriter writes each message as
+        soon as it is done. With echo the maillog lines with the message ID are printed as they are found.'''
+        # Create message object each time message ID is found in log.imss
+        messages = self.findMessagesinIMSSlogs(msgID)
+
+        # Create message object each time message ID is found in maillogs
+        maillog_messages = self.findMessagesinMaillogs(msgID, echo)
+
+        # Get all maillogs by queue ID for each maillog message found
+        maillog_index = self.getMaillogIndex()
+        for m in maillog_messages:
+            m.maillogs = getMaillogs(m, maillog_index, self.maillogFolder)
+
+        # Compare maillog_messages and combine the maillogs for the ones related by queue IDs
+        # Example: postfix/smtp[28130]: 7E0072C049: to=<joelg@joelg.com>, relay=localhost[127.0.0.1]:10025,
+        # delay=1.1, delays=0.38/0.02/0.06/0.61, dsn=2.0.0, status=sent (250 2.0.0 Ok: queued as B60FC2C04C)
+        # Queue ID was originally 7E0072C049 then was queued as B60FC2C04C, so B60FC2C04C is related to 7E0072C049
+        merged = combineMaillogMessages(maillog_messages) if maillog_messages else []
+        if writer:
+            # Written once their relatedQueueIDs are known from the chains
+            for m in maillog_messages:
+                writer.writeMaillogMessage(m)
+            writer.writeMergedMessages(merged)
+
+        # Internal IDs, policy events and queue IDs of the IMSS messages, from the indexes
+        logSet = self.logSet()
+        self.correlateMessages(messages, maillog_messages, merged, logSet)
+
+        # Get the process logs for all messages, reading each log.imss file only once
+        getIMSSLogsBatch(messages, logSet, writer=writer)
+
+        # Log lines of the IMSS messages and the maillog messages with the same external ID, in time order
+        if writer:
+            writer.writeTimelines(messages, maillog_messages)
+        return messages, maillog_messages, merged
+
+    def batchOutputDir(self, msgID):
+        '''Returns the folder for the results of one message ID of a batch search'''
+        return self.outputDir + "batch/" + re.sub(r'[^\w.@+=-]', "_", msgID) + "/"
+
+    def searchBatch(self, IDfile):
+        '''Searches for every message ID (or part of one) listed in IDfile, one per line. All IDs are matched at once
+        against the log.imss Message-ID index and a single pass over the maillogs, and the results for each ID are
+        written to batchOutputDir(ID) as each message is done. IDs are matched as literal text, not as regexes.'''
+        with open(IDfile, "r") as f:
+            IDs = list(dict.fromkeys(line.strip() for line in f if line.strip() and not line.startswith("#")))
+        logging.info(f"Searching for {len(IDs)} message IDs from {IDfile}")
+        matcher = MultiMatcher(IDs)
+
+        # Route each Message-ID line of the log.imss files to the IDs it matches
+        imss_hits = [[] for ID in IDs]
+        for file, file_index in self.getIMSSIndex().items():
+            for entry in file_index["entries"]:
+                if not self.inTimeWindow(IMSSLocalTime(entry[3] + " ")):
+                    continue
+                for i in matcher.search(entry[0]):
+                    imss_hits[i].append(newIMSSMessage(len(imss_hits[i]) + 1, file, entry))
+
+        # Same for the "message-id=<...>" lines of the maillog files, read once for all IDs
+        maillog_hits = [[] for ID in IDs]
+        maillog_files = listFiles(self.maillogFolder, "maillog*")
+        ranges = self.timeWindowRanges(MaillogTimeIndexFile, self.maillogFolder, maillog_files, sampleMaillogTimes)
+        for file, lines in scanFiles(searchFile, self.maillogFolder, maillog_files, "message-id=<", 0, b"message-id=<",
+                                     jobs=self.jobs, ranges=ranges).items():
+            lastWritten = fileLastWritten(self.maillogFolder + file)
+            for offset, line in lines:
+                if not self.inTimeWindow(maillogTime(line, lastWritten)):
+                    continue
+                for i in matcher.search(maillogExternalID(line)):
+                    maillog_hits[i].append(newMaillogMessage(len(maillog_hits[i]) + 1, file, line))
+
+        maillog_index = self.getMaillogIndex()
+        # One reader for the process logs of all IDs, so each log.imss file is still read only once
+        logSet = self.logSet()
+        processLogs = IMSSProcessLogs([message for hits in imss_hits for message in hits], logSet)
+        for i, ID in enumerate(IDs):
+            logging.info(f"{ID}: {len(imss_hits[i])} IMSS message(s), {len(maillog_hits[i])} maillog message(s)")
+            messages, maillog_messages = imss_hits[i], maillog_hits[i]
+            with ResultWriter(self.batchOutputDir(ID)) as writer:
+                for m in maillog_messages:
+                    m.maillogs = getMaillogs(m, maillog_index, self.maillogFolder)
+                merged_messages = combineMaillogMessages(maillog_messages) if maillog_messages else []
+                for m in maillog_messages:
+                    writer.writeMaillogMessage(m)
+                writer.writeMergedMessages(merged_messages)
+                self.correlateMessages(messages, maillog_messages, merged_messages, logSet)
+                getIMSSLogsBatch(messages, logSet, processLogs, writer)
+                writer.writeTimelines(messages, maillog_messages)
+
+    def logFingerprints(self):
+        '''{log file: [size, mtime]} of every log file of the CDT that a search reads'''
+        fingerprints = {}
+        for folder, pattern in ((IMSSLogDir, "log.imss*"), (IMSSLogDir, "polevt*"), (maillogDir + "/", "maillog*")):
+            for file in listFiles(self.workingDir + self.CDTfolder + folder, pattern):
+                fingerprints[folder + file] = fileFingerprint(self.workingDir + self.CDTfolder + folder + file)
+        return fingerprints
+
+    @profiled("result cache")
+    def cachedSearch(self, msgID, useCache=True, echo=False):
+        '''search() with its results written to outputDir. When the same query was searched before and the log files
+        did not change since, the results are copied from the ResultCache instead. Returns the number of
+        {"messages", "maillog_messages", "merged_messages"} found. Searches of the same CDT on other threads wait
+        for this one, as they write the same result files. A bad msgID raises before any result file is touched.'''
+        checkMessageID(msgID)
+        with pathLock(self.outputDir):
+            cache = ResultCache(self.outputDir)
+            query = ResultCache.query(msgID, self.since, self.until)
+            fingerprints = self.logFingerprints()
+            counts = cache.get(query, fingerprints, self.outputDir) if useCache else None
+            if counts is not None:
+                logging.info(f"Results copied from the result cache to {self.outputDir}")
+                return counts
+            with ResultWriter(self.outputDir) as writer:
+                found, found_maillogs, merged = self.search(msgID, writer, echo)
+            counts = {"messages": len(found), "maillog_messages": len(found_maillogs), "merged_messages": len(merged)}
+            cache.put(query, fingerprints, self.outputDir, counts)
+            return counts
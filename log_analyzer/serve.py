@@ -0,0 +1,103 @@
+# --serve: a local search service that keeps the indexes of the CDTs loaded between searches
+
+import os
+import re
+import json
+import asyncio
+import logging
+import urllib.parse
+import concurrent.futures
+
+from .searcher import Searcher
+from .logfiles import windowTime, pathLock
+from .results import jsonValue
+from .settings import IMSSLogDir, servePort
+
+searchers = {}  # (working folder, CDT name): Searcher, kept by each --serve worker process so the indexes stay loaded
+
+def serveSearcher(workingDir, CDTname):
+    '''Returns the Searcher of a CDT in a --serve worker process, preparing it on first use. The Searcher holds no
+    search state, so searches on several threads can share it; the first ones to ask for a CDT wait for one of them
+    to prepare it instead of each extracting and indexing it.'''
+    key = (workingDir, CDTname)
+    if key not in searchers:
+        with pathLock(os.path.join(workingDir, CDTname)):
+            if key not in searchers:
+                searcher = Searcher(workingDir, CDTname)
+                searcher.prepare()
+                searchers[key] = searcher
+    return searchers[key]
+
+def serveSearch(workingDir, CDTname, msgID, since=None, until=None):
+    '''Runs one --serve search on a worker process and returns the results as JSON types'''
+    found, found_maillogs, merged = serveSearcher(workingDir, CDTname).window(since, until).search(msgID)
+    return {
+        "cdt": CDTname,
+        "message_id": msgID,
+        "messages": [m.toDict() for m in found],
+        "maillog_messages": [m.toDict() for m in found_maillogs],
+        "merged_messages": [{"id": m.id, "externalID": m.externalID, "relatedQueueIDs": m.relatedQueueIDs,
+                             "maillogs": list(m.maillogs)} for m in merged],
+    }
+
+def availableCDTs(workingDir):
+    '''Names of the CDT zips and unzipped CDT folders in workingDir'''
+    names = {name for name in os.listdir(workingDir) if name.lower().endswith(".zip")}
+    names |= {name + ".zip" for name in os.listdir(workingDir)
+              if os.path.isdir(os.path.join(workingDir, name, IMSSLogDir))}
+    return sorted(names)
+
+async def handleServeRequest(reader, writer, pool, workingDir, defaultCDT=None):
+    '''Answers one HTTP request of --serve: GET /search?id=...[&cdt=...][&since=...][&until=...] or GET /cdts'''
+    status, result = "200 OK", None
+    try:
+        request = (await reader.readline()).decode("latin-1").split()
+        while (await reader.readline()).strip():
+            pass  # headers are not needed
+        if len(request) < 2 or request[0] != "GET":
+            raise ValueError("only GET requests are supported")
+        url = urllib.parse.urlsplit(request[1])
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        if url.path == "/cdts":
+            result = availableCDTs(workingDir)
+        elif url.path == "/search":
+            CDT = query.get("cdt", defaultCDT)
+            if CDT not in availableCDTs(workingDir):
+                raise ValueError(f"unknown CDT '{CDT}'")
+            if not query.get("id"):
+                raise ValueError("missing message ID, use ?id=")
+            since = windowTime(query["since"]) if query.get("since") else None
+            until = windowTime(query["until"]) if query.get("until") else None
+            logging.info(f"Search for '{query['id']}' in {CDT}")
+            result = await asyncio.get_running_loop().run_in_executor(pool, serveSearch, workingDir, CDT, query["id"],
+                                                                      since, until)
+        else:
+            status, result = "404 Not Found", {"error": f"unknown path {url.path}"}
+    except re.error as e:
+        status, result = "400 Bad Request", {"error": f"invalid message ID pattern: {e}"}
+    except ValueError as e:
+        status, result = "400 Bad Request", {"error": str(e)}
+    except Exception as e:
+        logging.exception(e)
+        status, result = "500 Internal Server Error", {"error": repr(e)}
+    body = json.dumps(result, default=jsonValue).encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode() + body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(workingDir, port=servePort, defaultCDT=None, jobs=1):
+    '''--serve: answers search requests for the CDTs in workingDir on 127.0.0.1:port until Ctrl+C. Clients are handled
+    concurrently, and each search runs on one of jobs worker processes, which keep the indexes of the CDTs they
+    searched loaded. Searches that don't say which CDT search defaultCDT.'''
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Warm up the default CDT so the first search doesn't have to build its indexes
+        if defaultCDT in availableCDTs(workingDir):
+            await asyncio.get_running_loop().run_in_executor(pool, serveSearcher, workingDir, defaultCDT)
+        server = await asyncio.start_server(
+            lambda reader, writer: handleServeRequest(reader, writer, pool, workingDir, defaultCDT), "127.0.0.1", port)
+        logging.warning(f"Serving searches of the CDTs in {workingDir} on http://127.0.0.1:{port}/search?id=...")
+        async with server:
+            await server.serve_forever()
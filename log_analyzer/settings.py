@@ -0,0 +1,79 @@
+# File names and tuning constants of the log search, shared by main.py and the modules of the package.
+# Kept in a module of their own with no heavy imports, so main.py can show them in --help without loading the rest.
+
+from datetime import timedelta
+
+# Log folders inside the unzipped CDT folder, and the password of the CDT zips
+IMSSLogDir = "IMSVA/LogFile/Event3/"
+maillogDir = "IMSVA/Logfile/Event5"
+CDTpassword = "trend"
+
+# Search results, indexes and the search log of a CDT go to this folder inside the CDT folder
+OutputFolder = "log_search_output/"
+
+# Message-ID index for log.imss files, saved in outputDir so repeat searches don't rescan the logs
+IMSSIndexFile = "___imss_index___.json"
+# First and last timestamp of each log.imss file
+IMSSTimeRangeFile = "___imss_timerange___.json"
+# A scan taking longer than this is not looked for in other rotated log.imss files
+maxScanTime = timedelta(minutes=30)
+
+# Postfix queue ID index for maillog files
+MaillogIndexFile = "___maillog_index___.json"
+
+# Internal ID index of the "Scan finished for" lines of the log.imss files, and of the polevt policy event logs
+# (in the same folder as log.imss), so a message's scan and policy events are joined by lookups instead of scans
+IMSSInternalIDIndexFile = "___imss_internalid_index___.json"
+PolevtIndexFile = "___polevt_index___.json"
+
+# Sparse [timestamp, byte offset] samples of each log file, so --since/--until can seek to the lines they need
+IMSSTimeIndexFile = "___imss_timeindex___.json"
+MaillogTimeIndexFile = "___maillog_timeindex___.json"
+# One sample is taken every timeSampleSize bytes of a log file
+timeSampleSize = 256 * 1024
+# --profile report, written next to log_search.log
+ProfileFile = "log_search_profile.json"
+CProfileFile = "log_search_profile.prof"
+
+# Hash and last search of a CDT zip, saved in its output folder so --cdts skips CDTs that were already searched
+CDTDoneFile = "___cdt_done___.json"
+# Summary of a --cdts run, saved in --dir
+CDTSummaryFile = "___cdt_summary___.json"
+
+# --export writes one row per log line to these files in outputDir
+ExportDatabaseFile = "___events___.sqlite"
+ExportParquetFiles = {"imss_events": "___imss_events___.parquet", "maillog_events": "___maillog_events___.parquet"}
+# Rows written to the export at a time
+exportBatchSize = 100000
+
+# --stats report, and the upper bounds in seconds of its scan time histogram bins
+ScanStatsFile = "___scan_stats___.json"
+scanTimeBins = [0, 1, 2, 5, 10, 30, 60, 120, 300, 600, float("inf")]
+# Number of slowest scans and process IDs --stats lists by default
+statsTop = 20
+
+# Results of earlier searches, kept in outputDir and reused while the log files they were found in are unchanged.
+# The least recently used results are removed once the cache is over resultCacheSize bytes.
+ResultCacheDir = "___result_cache___/"
+ResultCacheFile = "___result_cache___.json"
+resultCacheSize = 1024 * 1024 * 1024
+
+# --serve listens on this localhost port by default
+servePort = 8025
+
+# Offsets --follow has read the log files up to, by inode
+FollowStateFile = "___follow_state___.json"
+# --follow checks the log files for new lines every followInterval seconds and saves the indexes and offsets
+# every followSaveInterval
+followInterval = 2
+followSaveInterval = timedelta(minutes=1)
+
+# With --since/--until the maillogs are also read this far before and after the window, for the rest of the
+# lines of the queue IDs found in it
+maillogWindowMargin = timedelta(minutes=30)
+
+# When more process IDs than this are needed from a log.imss file, one pass over its lines is faster than
+# searching the file for each process ID
+maxProcessIDSearches = 16
+# With more than one job, log files bigger than this are split into byte ranges that are scanned in parallel
+scanChunkSize = 256 * 1024 * 1024
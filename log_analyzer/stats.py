@@ -0,0 +1,190 @@
+# --stats: scan time percentiles, histogram and outliers of all the scans in a CDT
+
+import os
+import re
+import json
+import heapq
+import bisect
+from array import array
+
+from .profiling import profiler, profiled
+from .logfiles import mapFile, IMSSLocalTime, parseIMSSTime
+from .indexes import scanFiles, sampleIMSSTimes
+from .settings import IMSSTimeIndexFile, ScanStatsFile, scanTimeBins, statsTop
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # --stats works out the same numbers in plain Python, only slower
+
+# Lines where a scan starts and ends, see getProcessLogsInFile()
+scanEventExp = re.compile(rb'Start Rule Set Retrieval spent|Scan finished for')
+
+def scanEventsFile(file, start=0, end=None):
+    '''Returns the scan starts and ends in a log.imss file as columns {"start": [True for a start, False for an end],
+    "procID", "time" (local "YYYY-MM-DD HH:MM:SS"), "seconds" (since the epoch), "offset"}, in file order'''
+    events = {"start": [], "procID": [], "time": [], "seconds": [], "offset": []}
+    with mapFile(file) as mm:
+        size = len(mm)
+        end = size if end is None or end > size else end
+        for hit in scanEventExp.finditer(mm, start):
+            line_start = mm.rfind(b"\n", 0, hit.start()) + 1
+            if line_start >= end:
+                break
+            if line_start < start:
+                continue
+            # 2021/11/05 13:12:18 GMT-03:00 [24790:3979802368] [I]Scan finished for 5A8E...
+            head = mm[line_start:hit.start()].decode("latin-1")
+            time = IMSSLocalTime(head)
+            fields = head.split(None, 4)
+            if time is None or len(fields) < 4:
+                continue
+            events["start"].append(hit.group() == b"Start Rule Set Retrieval spent")
+            events["procID"].append(fields[3])
+            events["time"].append(time)
+            events["seconds"].append(parseIMSSTime(head).timestamp())
+            events["offset"].append(line_start)
+    profiler.count("lines_scanned", len(events["start"]))
+    return events
+
+def percentile(values, q):
+    '''q-th percentile of sorted values, interpolated between the nearest two like numpy.percentile()'''
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def scanTimeStats(durations, groups=None):
+    '''Returns {group: {"count", "mean", "p50", "p90", "p99", "max"}} of the durations by the group label at the same
+    position in groups, or {None: ...} of all durations. Vectorized with numpy when it is installed.'''
+    if not len(durations):
+        return {}
+    quantiles = [50, 90, 99]
+    if numpy is not None:
+        if groups is None:
+            labels, codes = [None], numpy.zeros(len(durations), dtype=int)
+        else:
+            labels, codes = numpy.unique(numpy.array(groups, dtype=object), return_inverse=True)
+        durations = numpy.asarray(durations, dtype=float)
+        # Sort by group then duration, so each group is a sorted slice [starts, starts + counts)
+        values = durations[numpy.lexsort((durations, codes))]
+        counts = numpy.bincount(codes)
+        starts = numpy.cumsum(counts) - counts
+        columns = {"count": counts, "mean": numpy.bincount(codes, weights=durations) / counts}
+        for q in quantiles:
+            pos = (counts - 1) * q / 100
+            lo = numpy.floor(pos).astype(int)
+            hi = numpy.minimum(lo + 1, counts - 1)
+            columns[f"p{q}"] = values[starts + lo] + (values[starts + hi] - values[starts + lo]) * (pos - lo)
+        columns["max"] = values[starts + counts - 1]
+        return {label: {name: column[i].item() for name, column in columns.items()} for i, label in enumerate(labels)}
+
+    if groups is None:
+        groups = [None] * len(durations)
+    by_group = {}
+    for group, duration in zip(groups, durations):
+        by_group.setdefault(group, []).append(duration)
+    stats = {}
+    for group in sorted(by_group, key=lambda group: (group is not None, group)):
+        values = sorted(by_group[group])
+        stats[group] = {"count": len(values), "mean": sum(values) / len(values)}
+        stats[group].update({f"p{q}": percentile(values, q) for q in quantiles})
+        stats[group]["max"] = values[-1]
+    return stats
+
+def scanTimeHistogram(durations):
+    '''Number of durations in each scanTimeBins bin [lower, upper)'''
+    if numpy is not None:
+        bins = numpy.searchsorted(scanTimeBins, numpy.asarray(durations, dtype=float), side="right") - 1
+        # A clock set back during a scan makes it negative, count it in the first bin
+        counts = numpy.bincount(numpy.maximum(bins, 0), minlength=len(scanTimeBins) - 1).tolist()
+    else:
+        counts = [0] * (len(scanTimeBins) - 1)
+        for duration in durations:
+            counts[max(bisect.bisect_right(scanTimeBins, duration) - 1, 0)] += 1
+    return [{"from": lower, "to": upper, "count": count}
+            for lower, upper, count in zip(scanTimeBins, scanTimeBins[1:], counts)]
+
+def slowestScans(durations, top):
+    '''Positions of the top longest durations, longest first'''
+    if numpy is not None and len(durations) > top:
+        values = numpy.asarray(durations, dtype=float)
+        slowest = numpy.argpartition(values, -top)[-top:]
+        return slowest[numpy.argsort(-values[slowest], kind="stable")].tolist()
+    return heapq.nlargest(top, range(len(durations)), key=durations.__getitem__)
+
+@profiled("stats")
+def scanStats(searcher, top=statsTop):
+    '''--stats: scan times of every message in the CDT of searcher (a Searcher, whose since/until are honoured). The
+    scan starts and ends of all log.imss files are read in one pass (on its jobs processes), then each end is paired
+    with the last start of its process ID before it, across rotated files like getIMSSLogs() does. Returns the report
+    that is also saved to its outputDir.'''
+    logSet = searcher.logSet()
+    ranges = searcher.timeWindowRanges(IMSSTimeIndexFile, logSet.folder, logSet.files, sampleIMSSTimes)
+    events = scanFiles(scanEventsFile, logSet.folder, logSet.files, jobs=searcher.jobs, ranges=ranges)
+
+    durations = array("d")
+    scans = []  # [process ID, start time, file, byte offset] of each duration
+    started = {}  # process ID: start time, start seconds, file, byte offset of its open scan
+    unfinished = unstarted = 0
+    for file in logSet.files:
+        columns = events[file]
+        for is_start, procID, time, seconds, offset in zip(columns["start"], columns["procID"], columns["time"],
+                                                          columns["seconds"], columns["offset"]):
+            if is_start:
+                if procID in started:
+                    # Process started another scan without finishing the one before
+                    unfinished += 1
+                started[procID] = (time, seconds, file, offset)
+                continue
+            start = started.pop(procID, None)
+            if start is None:
+                # Scan started before the first log.imss file of the CDT, or before --since
+                unstarted += 1
+            elif searcher.inTimeWindow(start[0]):
+                durations.append(seconds - start[1])
+                scans.append([procID, start[0], start[2], start[3]])
+    unfinished += len(started)
+
+    hours = [time[:13] + ":00" for procID, time, file, offset in scans]
+    by_procID = scanTimeStats(durations, [procID for procID, time, file, offset in scans])
+    report = {
+        "scans": len(durations),
+        "unfinished_scans": unfinished,
+        "scans_without_start": unstarted,
+        "overall": scanTimeStats(durations).get(None),
+        "histogram": scanTimeHistogram(durations),
+        "per_hour": scanTimeStats(durations, hours),
+        "slowest_scans": [{"seconds": durations[i], "process_id": scans[i][0], "start": scans[i][1],
+                           "file": scans[i][2], "byte_offset": scans[i][3]} for i in slowestScans(durations, top)],
+        "slowest_process_ids": [dict(process_id=procID, **stats) for procID, stats in
+                                heapq.nlargest(top, by_procID.items(), key=lambda item: item[1]["mean"])],
+    }
+    os.makedirs(searcher.outputDir, exist_ok=True)
+    with open(searcher.outputDir + ScanStatsFile, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def printScanStats(report):
+    def row(label, stats):
+        print(f"{label:22} {stats['count']:>9} {stats['mean']:>8.1f} {stats['p50']:>8.1f} {stats['p90']:>8.1f} "
+              f"{stats['p99']:>8.1f} {stats['max']:>8.1f}")
+
+    print(f"{report['scans']} scans, {report['unfinished_scans']} without an end, "
+          f"{report['scans_without_start']} without a start")
+    if not report["scans"]:
+        return
+    print(f"\n{'Scan time (s)':22} {'count':>9} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    row("all", report["overall"])
+    for hour, stats in report["per_hour"].items():
+        row(hour, stats)
+    print("\nHistogram")
+    for bin in report["histogram"]:
+        print(f"{bin['from']:>6g}s - {bin['to']:<6g}s {bin['count']:>9}")
+    print("\nSlowest scans")
+    for scan in report["slowest_scans"]:
+        print(f"{scan['seconds']:>8.1f}s {scan['start']} {scan['process_id']} {scan['file']}:{scan['byte_offset']}")
+    print(f"\n{'Slowest process IDs':40} {'count':>9} {'mean':>8} {'p99':>8} {'max':>8}")
+    for stats in report["slowest_process_ids"]:
+        print(f"{stats['process_id']:40} {stats['count']:>9} {stats['mean']:>8.1f} {stats['p99']:>8.1f} "
+              f"{stats['max']:>8.1f}")